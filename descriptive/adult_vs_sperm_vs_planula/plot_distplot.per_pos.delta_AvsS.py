@@ -8,13 +8,17 @@ and sperm samples.
 """
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 import seaborn as sns
 
+import meth_matrix
+import sample_metadata
+
 # read data
-data = pd.read_table('../../all.filt.pct.tsv')
-data['a_mean'] = data.filter(regex='^A').mean(axis=1)
-data['s_mean'] = data.filter(regex='^S').mean(axis=1)
+data = meth_matrix.load_frame('../../all.filt.pct.mmap')
+adult = sample_metadata.group_indices(data.columns, stage='A')
+sperm = sample_metadata.group_indices(data.columns, stage='S')
+data['a_mean'] = data.iloc[:, adult].mean(axis=1)
+data['s_mean'] = data.iloc[:, sperm].mean(axis=1)
 
 # calculate delta only if both methylation levels are > 0
 data['delta_svsa'] = data.apply(lambda x: x['s_mean'] - x['a_mean']
@@ -8,14 +8,19 @@ Fujairah and Abu Dhabi samples.
 """
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 import seaborn as sns
 
+import meth_matrix
+import sample_metadata
+
 # read data
-data = pd.read_table('../../all.filt.pct.tsv')
-data = data.filter(regex='^A|^S')
-data['f_mean'] = data.filter(regex='-F').mean(axis=1)
-data['ad_mean'] = data.filter(regex='-AD').mean(axis=1)
+data = meth_matrix.load_frame('../../all.filt.pct.mmap')
+data = data.iloc[:, sample_metadata.group_indices(data.columns,
+                                                  stage=['A', 'S'])]
+fuj = sample_metadata.group_indices(data.columns, location='F')
+ad = sample_metadata.group_indices(data.columns, location='AD')
+data['f_mean'] = data.iloc[:, fuj].mean(axis=1)
+data['ad_mean'] = data.iloc[:, ad].mean(axis=1)
 
 # calculate delta only if both methylation levels are > 0
 data['delta_advsf'] = data.apply(lambda x: x['ad_mean'] - x['f_mean']
@@ -7,32 +7,15 @@ Plot transcript data from AD on one plot.
 """
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 from sklearn.decomposition import PCA
 
-def assign_samples(label):
-    """
-    Assign sample types based on the label.
-    """
-    if label[-2:] == '-F':
-        sample_type = 'Fujairah '
-    else:
-        sample_type = 'Abu Dhabi '
-    
-    if label[0] == 'A':
-        sample_type += 'Adult'
-    elif label[0] == 'E':
-        sample_type += 'Egg'
-    elif label[0] == 'S':
-        sample_type += 'Sperm'
-    elif label[0] == 'L':
-        sample_type += 'Larva'
-    
-    return sample_type
+import meth_matrix
+import sample_metadata
 
 # remove gene names, and filter out rows containing all 0s
-data = pd.read_table('../../all.filt.pct.tsv', usecols=range(2,25))
-data = data.filter(regex='-AD')
+data = meth_matrix.load_frame('../../all.filt.pct.mmap')
+data = data.iloc[:, sample_metadata.group_indices(data.columns,
+                                                  location='AD')]
 
 # PCA stuff
 pca = PCA(n_components=3)
@@ -43,7 +26,7 @@ pca_evr = [round(x * 100, 1) for x in pca.explained_variance_ratio_]
 fig, ax_array = plt.subplots(1, 3, figsize=(15, 5))
 point_labels = data.columns.tolist()
 
-labels = [assign_samples(x) for x in point_labels]
+labels = [sample_metadata.sample_label(x) for x in point_labels]
 
 colours = {'Fujairah Adult': '#08519c', 'Fujairah Sperm': '#6baed6',
            'Abu Dhabi Adult': '#a50f15', 'Abu Dhabi Sperm': '#fcae91',
@@ -7,11 +7,12 @@ Plots a correlation heatmap using seaborn.
 """
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 import seaborn as sns
 
+import meth_matrix
+
 # read in methylation %s: [0-100]
-data = pd.read_table('../../all.filt.pct.tsv', usecols=range(2,25))
+data = meth_matrix.load_frame('../../all.filt.pct.mmap')
 data_corr = data.corr(method='kendall')
 
 # save values in the correlation matrix as a file
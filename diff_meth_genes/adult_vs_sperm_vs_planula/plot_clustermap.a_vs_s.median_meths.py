@@ -10,6 +10,8 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 
+import sample_metadata
+
 # read genes of interest
 genes_of_interest = open('t-test.a_vs_s.goi.tsv').read().strip().split('\n')
 
@@ -17,7 +19,8 @@ genes_of_interest = open('t-test.a_vs_s.goi.tsv').read().strip().split('\n')
 data = pd.read_table('../bias_density_medians/all.median_meths.tsv', index_col=0)
 
 # subselect only adult and sperm samples
-data = data.filter(regex='^A|^S')
+data = data.iloc[:, sample_metadata.group_indices(data.columns,
+                                                  stage=['A', 'S'])]
 
 # pick out subset containing genes of interest
 data = data[data.index.isin(genes_of_interest)]
@@ -7,17 +7,24 @@ Plots a clustered per-gene median methylation heatmap to illustrate the
 difference in methylation in gametic (S7, E8, S8) vs. larval samples.
 """
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import seaborn as sns
 
+import sample_metadata
+
 # read genes of interest
 genes_of_interest = open('t-test.g_vs_l.goi.tsv').read().strip().split('\n')
 
 # read data
 data = pd.read_table('../bias_density_medians/all.median_meths.tsv', index_col=0)
 
-# subselect only appropriate sperm and larval samples
-data = data.filter(regex='^E8|^S7|^S8|^L')
+# subselect only appropriate sperm and larval samples (i.e. gametes from
+# colonies 7 and 8 from Abu Dhabi, the parents of the larvae)
+parents = sample_metadata.group_mask(data.columns, stage=['E', 'S'],
+                                     colony=['7-AD', '8-AD'])
+larvae = sample_metadata.group_mask(data.columns, stage='L')
+data = data.iloc[:, np.flatnonzero(parents | larvae)]
 
 # pick out subset containing genes of interest
 data = data[data.index.isin(genes_of_interest)]
@@ -14,6 +14,7 @@ import pandas as pd
 import scipy.stats
 
 import correct_p_values
+import sample_metadata
 
 # read data
 data = pd.read_table('../bias_density_medians/all.median_meths.tsv', index_col=0)
@@ -23,14 +24,15 @@ data = data[data['meth pos'] >= 5]
 data = data.drop('meth pos', axis=1)
 
 # subselect only adult and sperm samples
-data = data.filter(regex='^A|^S')
+data = data.iloc[:, sample_metadata.group_indices(data.columns,
+                                                  stage=['A', 'S'])]
 
 # retain genes that are methylated in the subselected samples
 data = data[data.max(axis=1) > 0]
 
-# use regexes to subselect groups of data
-adult = data.filter(regex='^A')
-sperm = data.filter(regex='^S')
+# use sample metadata to subselect groups of data
+adult = data.iloc[:, sample_metadata.group_indices(data.columns, stage='A')]
+sperm = data.iloc[:, sample_metadata.group_indices(data.columns, stage='S')]
 
 # while we're at it, check which groups have a delta meth of > 15% or < -15%
 data['delta_15pc'] = abs(adult.mean(axis=1) - sperm.mean(axis=1)) > 15
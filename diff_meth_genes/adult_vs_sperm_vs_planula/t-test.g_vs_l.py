@@ -10,10 +10,12 @@ median methylation levels between gametic and larval samples
 Only gametic samples corresponding to the parents of L1-L6 are considered in 
 this analysis to reduce the confounding effect of genetics on epigenetics.
 """
+import numpy as np
 import pandas as pd
 import scipy.stats
 
 import correct_p_values
+import sample_metadata
 
 # read data
 data = pd.read_table('../bias_density_medians/all.median_meths.tsv', index_col=0)
@@ -22,15 +24,20 @@ data = pd.read_table('../bias_density_medians/all.median_meths.tsv', index_col=0
 data = data[data['meth pos'] >= 5]
 data = data.drop('meth pos', axis=1)
 
-# subselect only appropriate sperm and larval samples
-data = data.filter(regex='^E8|^S7|^S8|^L')
+# subselect only appropriate sperm and larval samples (i.e. gametes from
+# colonies 7 and 8 from Abu Dhabi, the parents of the larvae)
+parents = sample_metadata.group_mask(data.columns, stage=['E', 'S'],
+                                     colony=['7-AD', '8-AD'])
+larvae = sample_metadata.group_mask(data.columns, stage='L')
+data = data.iloc[:, np.flatnonzero(parents | larvae)]
 
 # retain genes that are methylated in the subselected samples
 data = data[data.max(axis=1) > 0]
 
-# use regexes to subselect groups of data
-sperm = data.filter(regex='^E|^S')
-larval = data.filter(regex='^L')
+# use sample metadata to subselect groups of data
+sperm = data.iloc[:, sample_metadata.group_indices(data.columns,
+                                                   stage=['E', 'S'])]
+larval = data.iloc[:, sample_metadata.group_indices(data.columns, stage='L')]
 
 # while we're at it, check which groups have a delta meth of > 15% or < -15%
 data['delta_15pc'] = abs(sperm.mean(axis=1) - larval.mean(axis=1)) > 15
@@ -11,42 +11,79 @@ Multi-functional script calculates, on a per-gene basis, three values:
 Requires a genome (to calculate expected CpG fraction), a GFF3 file with gene
 information (to calculate observed CpG fraction) and an annotated cov file
 (to extract # of methylated CpGs in each gene).
+
+Each scaffold is read once into prefix sums of its 16 dinucleotides, so the
+dinucleotide counts of any gene (on either strand) are looked up without
+slicing or reverse complementing its sequence.
 """
 import argparse
-import collections
 import csv
 import itertools
 import statistics
 
-import natural_sort
+import numpy as np
+
+import natural_order
 import parse_fasta
 import parse_gff3
 
-def reverse_complement(seq):
-    seq = seq.replace('U', 'T')
-
-    translation_from = 'AaTtGgCcYyRrSsWwKkMmBbDdHhVvNn'
-    translation_to   = 'TtAaCcGgRrYySsWwMmKkVvHhDdBbNn'
-    translation_table = str.maketrans(translation_from, translation_to)
-
-    seq = seq[::-1].translate(translation_table)
-
-    return seq
+# dinucleotides are indexed as 4 * code(X) + code(Y), where A/C/G/T (upper
+# case only, as counted previously) have codes 0-3. every other character
+# (lowercase, N, ambiguous bases) has code 4, and is never part of a
+# dinucleotide
+DINUCS = [''.join(x) for x in itertools.product('ACGT', repeat=2)]
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+BASE_CODES[[ord(x) for x in 'ACGT']] = np.arange(4)
+
+# the complement of a base with code c has code 3 - c, and the reverse
+# complement of XY is comp(Y)comp(X). dinucleotide counts on the reverse
+# strand are hence forward counts, reordered with this index
+REVCOMP_DINUCS = np.array([4 * (3 - y) + (3 - x)
+                           for x, y in itertools.product(range(4), repeat=2)])
+
+def dinucleotide_prefix_sums(sequence):
+    """
+    Encodes sequence as a uint8 array, then returns an int32 array of shape
+    (len(sequence), 16), where row i contains the counts of each dinucleotide
+    that starts before position i.
+    """
+    codes = BASE_CODES[np.frombuffer(sequence.encode('latin-1'),
+                                     dtype=np.uint8)]
+    dinuc_codes = 4 * codes[:-1] + codes[1:]
+    dinuc_codes[(codes[:-1] == 4) | (codes[1:] == 4)] = 16
     
-def get_gene_sequence(sequence, coords):
+    prefix_sums = np.zeros((len(sequence), 16), dtype=np.int32)
+    for n in range(16):
+        np.cumsum(dinuc_codes == n, out=prefix_sums[1:, n])
+    
+    return prefix_sums
+
+def count_gene_dinucleotides(prefix_sums, coords):
+    """
+    Returns counts of the 16 dinucleotides (in the order of DINUCS) of a gene
+    and the gene's length, from the prefix sums of its scaffold. Genes with
+    startpos > endpos are on the reverse strand, where counts are those of
+    the reverse complemented sequence[endpos:startpos].
+    """
     startpos, endpos = coords
     
     revcomp_seq = False
     if startpos > endpos:
-        # set reverse complement flag!
         startpos, endpos = endpos, startpos
         revcomp_seq = True
-
-    # slice sequence
-    sliced_seq = sequence[startpos:endpos]
-    if revcomp_seq: sliced_seq = reverse_complement(sliced_seq)
     
-    return sliced_seq
+    # clip coords in the same way as slicing sequence[startpos:endpos]
+    startpos, endpos, _ = slice(startpos, endpos).indices(len(prefix_sums))
+    gene_length = max(endpos - startpos, 0)
+    if gene_length < 2:
+        return np.zeros(16, dtype=np.int64), gene_length
+    
+    # dinucleotides of the gene start from startpos to endpos - 2
+    dinuc_counts = prefix_sums[endpos - 1].astype(np.int64) - \
+                   prefix_sums[startpos]
+    if revcomp_seq: dinuc_counts = dinuc_counts[REVCOMP_DINUCS]
+    
+    return dinuc_counts, gene_length
 
 parser = argparse.ArgumentParser(description="""
 Multi-functional script calculates, on a per-gene basis, three values:
@@ -94,22 +131,23 @@ print ('gene', 'meth pos', 'observed CpG', 'expected CpG', 'CpG bias',
 #   E = p(C) . p(G) is vulnerable to ambiguous dinucleotides ('CD', 'CN', ...).
 #   instead, calculate p(C) = p(CA) + p(CC) + p(CG) + p(CT).
 
-# perform per-gene calculations!
-valid_dinuc =  [''.join(x) for x in itertools.product('ACGT', repeat=2)]
-cx_dinuc = ['C' + x for x in 'ACGT']
-gx_dinuc = ['G' + x for x in 'ACGT']
+# perform per-gene calculations! every scaffold is encoded once, after which
+# dinucleotide counts of any gene are a subtraction of two prefix sums
+cpg_index = DINUCS.index('CG')
+cx_index = [DINUCS.index('C' + x) for x in 'ACGT']
+gx_index = [DINUCS.index('G' + x) for x in 'ACGT']
 
 results = {}
 for scaf in scaffold_gff3:
+    prefix_sums = dinucleotide_prefix_sums(genome_sequence[scaf])
     for gene in scaffold_gff3[scaf]:
-        gene_sequence = get_gene_sequence(genome_sequence[scaf],
-                                          scaffold_gff3[scaf][gene].coords)
-        gene_dinuc = collections.Counter([''.join(x) for x in \
-            zip(gene_sequence[:-1], gene_sequence[1:])])
-        cpg_observed = gene_dinuc['CG']
-        cpg_expected = sum([gene_dinuc[x] for x in cx_dinuc]) *\
-                       sum([gene_dinuc[x] for x in gx_dinuc])
-        cpg_expected = round(cpg_expected / len(gene_sequence), 2)
+        gene_dinuc, gene_length = count_gene_dinucleotides(
+            prefix_sums, scaffold_gff3[scaf][gene].coords)
+        gene_dinuc = gene_dinuc.tolist()
+        cpg_observed = gene_dinuc[cpg_index]
+        cpg_expected = sum([gene_dinuc[x] for x in cx_index]) *\
+                       sum([gene_dinuc[x] for x in gx_index])
+        cpg_expected = round(cpg_expected / gene_length, 2)
         cpg_bias = round(cpg_observed / cpg_expected, 4)
         
         # believe it or not, there are genes WITHOUT a single CpG dinuc...
@@ -129,6 +167,6 @@ for scaf in scaffold_gff3:
                              meth_density, median_meth_pct]
 
 # output
-for r in natural_sort.natural_sort(results):
+for r in natural_order.natural_sort(results):
     # replace 'PdaeGene' with 'Pdae'
     print (r.replace('PdaeGene', 'Pdae'), *results[r], sep='\t')
@@ -7,13 +7,147 @@ Script to merge similar tsvs together, by checking common keys in the first
 column (by default, can be toggled with --key).
 
 Headers are assumed to be NOT PRESENT by default!
+
+With --stream, keys are joined on the fly instead of in memory, producing the
+same output. Files that are already sorted by key (in natural order) are read
+row by row and joined via a heap-based k-way merge; files that are not are
+first split into sorted runs of --run-rows rows, which are spilled to
+temporary files and merged back. Memory use hence depends on the number of
+files (and --run-rows), not on the number of rows.
 """
 import argparse
 import csv
+import heapq
 import re
 import sys
+import tempfile
+
+import natural_order
+
+def natural_key(text):
+    """
+    Sort key that orders strings the same way as natural_sort.natural_sort().
+    Ties (e.g. strings differing only in case) are broken by the string itself.
+    """
+    return natural_order.natural_key(text), text
+
+def parse_row(row):
+    """
+    Returns (row_key, row_val) of a row, as per --key and --col.
+    """
+    row_key = '\t'.join([row[k] for k in args.key])
+    
+    if args.col:
+        row_val = '\t'.join([row[c] for c in args.col])
+    else:
+        row_val = '\t'.join([row[c] for c in range(len(row))
+                             if c not in args.key])
+    
+    return row_key, row_val
+
+def update_max_cols(max_cols, row, row_val):
+    """
+    Widest value of rows (when --col is not specified), used for padding.
+    """
+    if not args.col and len(row) > max_cols:
+        max_cols = len(row_val.split('\t'))
+    
+    return max_cols
+
+def scan_file(tsv_reader, max_cols):
+    """
+    Reads all rows of tsv_reader, checking whether keys are sorted in the
+    same order as the final output. Returns (is_sorted, max_cols).
+    """
+    is_sorted = True
+    prev_key = None
+    for row in tsv_reader:
+        if not row: continue
+        
+        row_key, row_val = parse_row(row)
+        max_cols = update_max_cols(max_cols, row, row_val)
+        
+        sort_key = natural_key(row_key)
+        if prev_key is not None and sort_key < prev_key:
+            is_sorted = False
+        prev_key = sort_key
+    
+    return is_sorted, max_cols
+
+def write_run(run_rows, tmp_dir):
+    """
+    Sorts rows by key (stably, so that duplicated keys stay in file order)
+    and writes them to a temporary file. Returns the name of the file.
+    """
+    run_rows.sort(key=lambda x: natural_key(x[0]))
+    with tempfile.NamedTemporaryFile('w', dir=tmp_dir, newline='',
+                                     delete=False) as run_file:
+        csv.writer(run_file, delimiter='\t').writerows(run_rows)
+    
+    return run_file.name
+
+def spill_runs(tsv_reader, max_cols, tmp_dir):
+    """
+    Reads rows of tsv_reader in chunks of --run-rows rows, writing each chunk
+    as a sorted run to tmp_dir. Returns (run filenames, max_cols).
+    """
+    run_filenames = []
+    run_rows = []
+    for row in tsv_reader:
+        if not row: continue
+        
+        row_key, row_val = parse_row(row)
+        max_cols = update_max_cols(max_cols, row, row_val)
+        
+        run_rows.append((row_key, row_val))
+        if len(run_rows) == args.run_rows:
+            run_filenames.append(write_run(run_rows, tmp_dir))
+            run_rows = []
+    
+    if run_rows:
+        run_filenames.append(write_run(run_rows, tmp_dir))
+    
+    return run_filenames, max_cols
+
+def read_sorted_file(tsv_reader):
+    """
+    Yields (natural_key(row_key), row_key, row_val) of a sorted file.
+    """
+    for row in tsv_reader:
+        if not row: continue
+        
+        row_key, row_val = parse_row(row)
+        yield natural_key(row_key), row_key, row_val
 
-import natural_sort
+def read_runs(run_filenames):
+    """
+    Yields (natural_key(row_key), row_key, row_val) of the k-way merge of
+    sorted runs. Runs are merged in the order they were written, so that
+    duplicated keys stay in file order.
+    """
+    def read_run(run_filename):
+        with open(run_filename, newline='') as run_file:
+            for row_key, row_val in csv.reader(run_file, delimiter='\t'):
+                yield natural_key(row_key), row_key, row_val
+    
+    return heapq.merge(*[read_run(r) for r in run_filenames],
+                       key=lambda x: x[0])
+
+def tag_rows(rows, tag):
+    """
+    Appends tag to every row yielded by rows.
+    """
+    for row in rows:
+        yield (*row, tag)
+
+def format_row(row_key, row_vals):
+    """
+    Formats a row of the output table, where row_vals contains values of the
+    row key in each file (keyed by filename).
+    """
+    return '\t'.join([row_key] + [row_vals[x.name] if x.name in row_vals
+                                  else '\t' * (max_cols - 1)
+                                  for x in args.tsv_files])
 
 parser = argparse.ArgumentParser(description="""
 Script to merge similar tsvs together, by checking common keys in the first
@@ -31,10 +165,22 @@ parser.add_argument('--key', '-k', metavar="key_columns",
 parser.add_argument('--col', '-c', metavar="retained_columns",
                     type=int, nargs='+',
                     help="(0-based) columns as values (default: all except -k)")
+parser.add_argument('--stream', action='store_true',
+                    help="""join keys on the fly with bounded memory; unsorted
+                    files are sorted via temporary files.""")
+parser.add_argument('--run-rows', metavar="n_rows", type=int, default=1000000,
+                    help="""rows per sorted run of unsorted files in --stream
+                    mode (default: 1000000).""")
+parser.add_argument('--tmp-dir', metavar="tmp_dir",
+                    help="""folder for sorted runs in --stream mode (default:
+                    system temporary folder).""")
 parser.add_argument('-v', action='store_true',
                     help="verbose mode, prints extra details to stderr.")
 args = parser.parse_args()
 
+if args.run_rows < 1:
+    parser.error('--run-rows has to be >= 1')
+
 giant_dict = {}
 max_cols = len(args.col) if args.col else 0
 
@@ -48,6 +194,10 @@ if args.v:
         print ('Headers are NOT PRESENT.', file=sys.stderr)
 
 # read data
+if args.stream:
+    tmp_dir = tempfile.TemporaryDirectory(dir=args.tmp_dir)
+    file_rows = []
+
 for tsv_file in args.tsv_files:
     tsv_reader = csv.reader(tsv_file, delimiter='\t')
     
@@ -59,26 +209,42 @@ for tsv_file in args.tsv_files:
         print ('\rReading file #{}'.format(args.tsv_files.index(tsv_file) + 1),
             end='', file=sys.stderr)
     
+    if args.stream:
+        # stdin can't be read twice, hence can't be checked for sortedness
+        is_sorted = False
+        if tsv_file.seekable():
+            is_sorted, max_cols = scan_file(tsv_reader, max_cols)
+            tsv_file.seek(0)
+            tsv_reader = csv.reader(tsv_file, delimiter='\t')
+            if args.header:
+                next(tsv_reader)
+        
+        if is_sorted:
+            file_rows.append(read_sorted_file(tsv_reader))
+        else:
+            if args.v:
+                print ('\n{} is unsorted, sorting it via temporary '
+                       'files...'.format(tsv_file.name), file=sys.stderr)
+            
+            run_filenames, max_cols = spill_runs(tsv_reader, max_cols,
+                                                 tmp_dir.name)
+            file_rows.append(read_runs(run_filenames))
+        
+        continue
+    
     for row in tsv_reader:
         # skip empty rows
         if not row: continue
         
-        row_key = '\t'.join([row[k] for k in args.key])
-        
-        if args.col:
-            row_val = '\t'.join([row[c] for c in args.col])
-        else:
-            row_val = '\t'.join([row[c] for c in range(len(row))
-                                 if c not in args.key])
-            if len(row) > max_cols:
-                max_cols = len(row_val.split('\t'))
+        row_key, row_val = parse_row(row)
+        max_cols = update_max_cols(max_cols, row, row_val)
         
         if row_key not in giant_dict:
             giant_dict[row_key] = {}
 
         giant_dict[row_key][tsv_file.name] = row_val
 
-if args.v:
+if args.v and not args.stream:
     print ('\nUnion of all files produces {} rows.'.format(len(giant_dict)),
         file=sys.stderr)
 
@@ -95,6 +261,37 @@ if args.header:
                                 if c not in args.key])
     print ('\t'.join([header_key] + [header_val] * len(args.tsv_files)))
     
-for g in natural_sort.natural_sort(giant_dict):
-    print ('\t'.join([g] + [giant_dict[g][x.name] if x.name in giant_dict[g]
-                            else '\t' * (max_cols - 1) for x in args.tsv_files]))
+if args.stream:
+    # rows of all files arrive in output order; values of a key are collected
+    # until the next key shows up
+    merged_rows = heapq.merge(*[tag_rows(r, n) for n, r in enumerate(file_rows)],
+                              key=lambda x: x[0])
+    current_key = None
+    row_vals = {}
+    counter_rows = 0
+    for _, row_key, row_val, file_index in merged_rows:
+        if row_key != current_key:
+            if current_key is not None:
+                print (format_row(current_key, row_vals))
+                counter_rows += 1
+            
+            current_key = row_key
+            row_vals = {}
+        
+        row_vals[args.tsv_files[file_index].name] = row_val
+    
+    if current_key is not None:
+        print (format_row(current_key, row_vals))
+        counter_rows += 1
+    
+    tmp_dir.cleanup()
+    
+    if args.v:
+        print ('\nUnion of all files produces {} rows.'.format(counter_rows),
+            file=sys.stderr)
+else:
+    # natural_order.natural_sort() orders keys exactly as natural_key() does
+    # (including ties, and 'scaffold\tpos' keys with mixed digit/non-digit
+    # scaffold names), so that output is identical to --stream
+    for g in natural_order.natural_sort(giant_dict):
+        print (format_row(g, giant_dict[g]))
@@ -7,12 +7,63 @@ Perform a GLM analysis on a per-gene basis to detect significant changes in
 mean methylation levels that can be attributed to developmental stage
 (adult, sperm, larval) or geographical origin (Fujairah, Abu Dhabi), or
 through the interaction of both variables!
+
+As every gene has the same design (mean_meth ~ devt_stage * location, over the
+same samples), the Gaussian GLM (i.e. ordinary least squares) is fitted to all
+genes at once: the design matrix is built once from the sample names, and
+coefficients, standard errors and Wald p-values of all genes are calculated
+as matrix operations. Results are the same as those of statsmodels' GLM with a
+Gaussian family, fitted per gene.
 """
+import numpy as np
 import pandas as pd
-import statsmodels.api as sm
-import statsmodels.formula.api as smf
+import scipy.stats
 
 import correct_p_values
+import sample_metadata
+
+def build_design(samples):
+    """
+    Builds the design matrix of mean_meth ~ devt_stage * location from
+    sample names (e.g. A1-F: adult from Fujairah), with the same columns as
+    the statsmodels formula:
+      Intercept, devt_stage[T.L], devt_stage[T.S], location[T.F],
+      devt_stage[T.L]:location[T.F], devt_stage[T.S]:location[T.F]
+    Adults (A) and Abu Dhabi (AD) are the reference levels.
+    """
+    larval = sample_metadata.group_mask(samples, stage='L').astype(float)
+    sperm = sample_metadata.group_mask(samples, stage='S').astype(float)
+    fujairah = sample_metadata.group_mask(samples, location='F').astype(float)
+    return np.column_stack([np.ones(len(samples)), larval, sperm, fujairah,
+                            larval * fujairah, sperm * fujairah])
+
+def fit_gaussian_glm(design, meths):
+    """
+    Fits a Gaussian GLM (identity link) to every row of meths (genes x
+    samples) simultaneously. Like statsmodels, the pseudoinverse of the
+    design is used, so that coefficients that cannot be estimated (e.g. the
+    larval:Fujairah interaction, as all larvae are from Abu Dhabi) are 0,
+    with a standard error of 0.
+    
+    Returns coefficients, standard errors and p-values of Wald (z) tests, all
+    as genes x coefficients arrays.
+    """
+    design_pinv = np.linalg.pinv(design)
+    coefs = meths @ design_pinv.T
+    resids = meths - coefs @ design.T
+    
+    # scale (dispersion) is estimated as the Pearson chi2 / residual df
+    df_resid = design.shape[0] - np.linalg.matrix_rank(design)
+    scale = (resids ** 2).sum(axis=1) / df_resid
+    
+    # pinv(X) @ pinv(X).T == pinv(X'X)
+    cov_unscaled = design_pinv @ design_pinv.T
+    std_errs = np.sqrt(np.outer(scale, np.diag(cov_unscaled)))
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pvals = 2 * scipy.stats.norm.sf(np.abs(coefs / std_errs))
+    
+    return coefs, std_errs, pvals
 
 # read data
 data = pd.read_table('../bias_density_medians/all.median_meths.tsv', index_col=0)
@@ -25,31 +76,16 @@ data = data[data.max(axis=1) > 0]
 # drop E8-AD: not much one can do, statistically, with n=1
 data = data.drop('E8-AD', axis=1)
 
-# convert each row into a dataframe that can be used for subsequent GLM
-pval_table = pd.DataFrame()
-for gene, row in data.iterrows():
-    data_per_gene = pd.DataFrame({'location': [], 'devt_stage': [], 
-                                  'mean_meth': []})
-    for r in row.iteritems():
-        loc = r[0].split('-')[1]
-        devt = r[0][0]
-        meth = float(r[1])
-        temp = pd.DataFrame({'location': loc, 'devt_stage': devt,
-                             'mean_meth': meth}, index=[0])
-        data_per_gene = pd.concat([data_per_gene, temp], ignore_index=True)
-        
-    model = smf.glm('mean_meth ~ devt_stage * location', data=data_per_gene,
-                    family=sm.families.Gaussian())
-    results = model.fit()
-    
-    # hardcode parsing of results' p values
-    pvals = results.pvalues.values
-    temp = pd.DataFrame({'devt_larval': pvals[1],
-                         'devt_sperm': pvals[2],
-                         'location': pvals[3],
-                         'devt_sperm:location': pvals[5]}, index=[gene])
-    
-    pval_table = pd.concat([pval_table, temp])
+# fit all genes at once
+design = build_design(data.columns)
+_, _, pvals = fit_gaussian_glm(design, data.values.astype(np.float64))
+
+# hardcode parsing of results' p values
+pval_table = pd.DataFrame({'devt_larval': pvals[:, 1],
+                           'devt_sperm': pvals[:, 2],
+                           'location': pvals[:, 3],
+                           'devt_sperm:location': pvals[:, 5]},
+                          index=data.index)
 
 # correct for multiple testing
 x = pd.Series(correct_p_values.correct_p_values(pval_table['devt_larval']),
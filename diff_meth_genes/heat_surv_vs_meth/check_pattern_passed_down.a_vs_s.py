@@ -15,6 +15,9 @@ import numpy as np
 import pandas as pd
 import scipy.stats
 
+import meth_matrix
+import sample_metadata
+
 # read survival data, and grab genes with changes in meth that strongly
 # correlates with survival data (|r| > 0.8) 
 heat_surv_data = pd.read_table('heat_surv_vs_meth.tsv', index_col=0)
@@ -30,8 +33,9 @@ meth_pos_context_data['gene'] = \
 
 # read table of meth values, subselect adult and sperm samples, then append
 # gene context into the table
-meth_data = pd.read_table('../../all.filt.pct.tsv', usecols=range(2,25))
-meth_data = meth_data.filter(regex='^[A|S]')
+meth_data = meth_matrix.load_frame('../../all.filt.pct.mmap')
+meth_data = meth_data.iloc[:, sample_metadata.group_indices(meth_data.columns,
+                                                            stage=['A', 'S'])]
 meth_data['gene'] = meth_pos_context_data['gene']
 
 # subselect meth_data rows corresponding to all genes used in earlier analysis
@@ -51,9 +55,10 @@ with open('check_pattern_passed_down.a_vs_s.tsv', 'w') as f:
     tau2 = []
     tau3 = []
     for n in range(1, 9):
-        temp1 = meth_data.filter(regex=f'{n}-')
-        temp2 = all_genes_data.filter(regex=f'{n}-')
-        temp3 = high_corr_genes_data.filter(regex=f'{n}-')
+        colony = sample_metadata.group_indices(meth_data.columns, replicate=n)
+        temp1 = meth_data.iloc[:, colony]
+        temp2 = all_genes_data.iloc[:, colony]
+        temp3 = high_corr_genes_data.iloc[:, colony]
         
         # crash code intentionally if either temps do not have 2 columns
         assert len(temp1.columns) == len(temp2.columns) == len(temp3.columns) == 2, \
@@ -15,6 +15,9 @@ import numpy as np
 import pandas as pd
 import scipy.stats
 
+import meth_matrix
+import sample_metadata
+
 # read survival data, and grab genes with changes in meth that strongly
 # correlates with survival data (|r| > 0.8) 
 heat_surv_data = pd.read_table('heat_surv_vs_meth.tsv', index_col=0)
@@ -28,10 +31,14 @@ meth_pos_context_data = pd.read_table('../../A1-F.cov', usecols=[6],
 meth_pos_context_data['gene'] = \
     meth_pos_context_data['gene'].apply(lambda x: x.replace('PdaeGene', 'Pdae'))
 
-# read table of meth values, subselect adult and sperm samples, then append
-# gene context into the table
-meth_data = pd.read_table('../../all.filt.pct.tsv', usecols=range(2,25))
-meth_data = meth_data.filter(regex='^[E|L|S].-AD').drop(['S5-AD', 'S6-AD'], 1)
+# read table of meth values, subselect gametes from colonies 7 and 8 from Abu
+# Dhabi (the parents of the larvae) and larval samples, then append gene
+# context into the table
+meth_data = meth_matrix.load_frame('../../all.filt.pct.mmap')
+parents = sample_metadata.group_mask(meth_data.columns, stage=['E', 'S'],
+                                     colony=['7-AD', '8-AD'])
+larvae = sample_metadata.group_mask(meth_data.columns, stage='L')
+meth_data = meth_data.iloc[:, np.flatnonzero(parents | larvae)]
 meth_data['gene'] = meth_pos_context_data['gene']
 
 # subselect meth_data rows corresponding to all genes used in earlier analysis
@@ -10,6 +10,8 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 
+import sample_metadata
+
 # hardcoded survival index values
 surv_index = {'S1-F': 0.789439953,
               'S3-F': 0.998209258,
@@ -29,7 +31,8 @@ data = data.loc[:, 'gene':'S8-AD']
 # melt data for plotting, then add survival data and sample location
 data = data.melt(id_vars='gene', var_name='sample', value_name='meth_pct')
 data['surv_index'] = data['sample'].apply(lambda x: surv_index[x])
-data['location'] = data['sample'].apply(lambda x: x.split('-')[-1])
+locations = sample_metadata.sample_table(surv_index)['location'].astype(str)
+data['location'] = data['sample'].map(locations)
 
 # plot the lmplot!
 sns.set(style='ticks', font_scale=1)
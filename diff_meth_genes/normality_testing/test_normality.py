@@ -7,11 +7,70 @@ Perform a GLM analysis on a per-gene basis to detect significant changes in
 mean methylation levels that can be attributed to developmental stage
 (adult, sperm, larval) or geographical origin (Fujairah, Abu Dhabi), or
 through the interaction of both variables!
+
+Groups of samples are determined once from the sample names. Levene's tests
+are calculated for all genes at once (following the steps of
+scipy.stats.levene, so p-values are the same), while Shapiro-Wilk tests are
+run on chunks of genes in parallel with --jobs.
 """
+import argparse
+import multiprocessing
+
+import numpy as np
 import pandas as pd
 import scipy.stats
 
 import correct_p_values
+import sample_metadata
+
+def levene_median(*groups):
+    """
+    Levene's test (centred on medians, i.e. Brown-Forsythe) of every row of
+    the groups (genes x samples matrices), in the same order of operations as
+    scipy.stats.levene. Returns p-values of all rows.
+    """
+    # rows have to be contiguous, so that numpy sums each row in the same
+    # order as a 1-d array (i.e. as in scipy.stats.levene)
+    groups = [np.ascontiguousarray(g) for g in groups]
+    k = len(groups)
+    n_i = np.array([g.shape[1] for g in groups], dtype=float)
+    n_total = n_i.sum()
+    
+    z_ij = [np.abs(g - np.median(g, axis=1)[:, None]) for g in groups]
+    z_bar_i = np.column_stack([np.mean(z, axis=1) for z in z_ij])
+    
+    z_bar = 0.0
+    for i in range(k):
+        z_bar += z_bar_i[:, i] * n_i[i]
+    z_bar /= n_total
+    
+    numer = (n_total - k) * np.sum(n_i * (z_bar_i - z_bar[:, None]) ** 2,
+                                   axis=1)
+    dvar = 0.0
+    for i in range(k):
+        dvar += np.sum((z_ij[i] - z_bar_i[:, i][:, None]) ** 2, axis=1)
+    
+    denom = (k - 1.0) * dvar
+    W = numer / denom
+    return scipy.stats.f.sf(W, k - 1, n_total - k)
+
+def shapiro_chunk(groups):
+    """
+    Shapiro-Wilk tests of every row of every group (genes x samples
+    matrices). Returns a genes x groups array of p-values.
+    """
+    return np.array([[scipy.stats.shapiro(g[n])[1] for g in groups]
+                     for n in range(len(groups[0]))])
+
+parser = argparse.ArgumentParser(description="""
+Tests median methylation of every gene for normality and equal variances.""")
+
+parser.add_argument('--jobs', '-j', metavar='n_jobs', type=int, default=1,
+                    help="run Shapiro-Wilk tests in parallel (default: 1).")
+parser.add_argument('--chunksize', metavar='n_genes', type=int, default=1000,
+                    help="""genes per chunk of Shapiro-Wilk tests (default:
+                    1000).""")
+args = parser.parse_args()
 
 # read data
 data = pd.read_table('../bias_density_medians/all.median_meths.tsv', index_col=0)
@@ -24,45 +83,34 @@ data = data[data.max(axis=1) > 0]
 # drop E8-AD: not much one can do, statistically, with n=1
 data = data.drop('E8-AD', axis=1)
 
-# convert each row into a dataframe that can be used for subsequent GLM
-pval_table = pd.DataFrame()
-for gene, row in data.iterrows():
-    data_per_gene = pd.DataFrame({'location': [], 'devt_stage': [], 
-                                  'median_meth': []})
-    for r in row.iteritems():
-        loc = r[0].split('-')[1]
-        devt = r[0][0]
-        meth = float(r[1])
-        temp = pd.DataFrame({'location': loc, 'devt_stage': devt,
-                             'median_meth': meth}, index=[0])
-        data_per_gene = pd.concat([data_per_gene, temp], ignore_index=True)
-    
-    # perform normality/equal variance tests
-    a_meths = data_per_gene[data_per_gene['devt_stage'] == 'A']['median_meth']
-    s_meths = data_per_gene[data_per_gene['devt_stage'] == 'S']['median_meth']
-    l_meths = data_per_gene[data_per_gene['devt_stage'] == 'L']['median_meth']
-    ad_meths = data_per_gene[data_per_gene['location'] == 'AD'][data_per_gene['devt_stage'] != 'L']['median_meth']
-    f_meths = data_per_gene[data_per_gene['location'] == 'F']['median_meth']
-    
-    levene_devt_p = scipy.stats.levene(a_meths, s_meths, l_meths)[1]
-    levene_location_p = scipy.stats.levene(ad_meths, f_meths)[1]
-    
-    shapiro_a_p = scipy.stats.shapiro(a_meths)[1]
-    shapiro_s_p = scipy.stats.shapiro(s_meths)[1]
-    shapiro_l_p = scipy.stats.shapiro(l_meths)[1]
-    shapiro_ad_p = scipy.stats.shapiro(ad_meths)[1]
-    shapiro_f_p = scipy.stats.shapiro(f_meths)[1]
-    
-    # hardcode parsing of results' p values
-    temp = pd.DataFrame({'levene_devt': levene_devt_p,
-                         'levene_location': levene_location_p,
-                         'shapiro_a': shapiro_a_p,
-                         'shapiro_s': shapiro_s_p,
-                         'shapiro_l': shapiro_l_p,
-                         'shapiro_ad': shapiro_ad_p,
-                         'shapiro_f': shapiro_f_p}, index=[gene])
-    
-    pval_table = pd.concat([pval_table, temp])
+# groups of samples, by developmental stage and location
+samples = data.columns
+meths = data.values.astype(np.float64)
+a_meths = meths[:, sample_metadata.group_indices(samples, stage='A')]
+s_meths = meths[:, sample_metadata.group_indices(samples, stage='S')]
+l_meths = meths[:, sample_metadata.group_indices(samples, stage='L')]
+ad_meths = meths[:, sample_metadata.group_indices(samples, location='AD',
+                                                  stage=['A', 'E', 'S'])]
+f_meths = meths[:, sample_metadata.group_indices(samples, location='F')]
+
+# perform normality/equal variance tests
+levene_devt_p = levene_median(a_meths, s_meths, l_meths)
+levene_location_p = levene_median(ad_meths, f_meths)
+
+groups = [a_meths, s_meths, l_meths, ad_meths, f_meths]
+chunks = [[g[n:n + args.chunksize] for g in groups]
+          for n in range(0, len(data), args.chunksize)]
+with multiprocessing.Pool(args.jobs) as pool:
+    shapiro_p = np.concatenate(pool.map(shapiro_chunk, chunks))
+
+# hardcode parsing of results' p values
+pval_table = pd.DataFrame({'levene_devt': levene_devt_p,
+                           'levene_location': levene_location_p,
+                           'shapiro_a': shapiro_p[:, 0],
+                           'shapiro_s': shapiro_p[:, 1],
+                           'shapiro_l': shapiro_p[:, 2],
+                           'shapiro_ad': shapiro_p[:, 3],
+                           'shapiro_f': shapiro_p[:, 4]}, index=data.index)
 
 # correct for multiple testing
 for cols in pval_table.columns:
@@ -9,6 +9,27 @@ in ALL samples (i.e. unmethylated + methylated reads > 0) (criteria II). To
 make sure that lowly methylated loci are truly methylated, at least one of the 
 treatments needs to have >= 1 methylated read in all replicates (criteria III).
 
+Samples and treatments are described in a sample sheet, a tsv with the
+columns "sample", "treatment", "location", "stage", "include" (yes/no) and
+optionally "criteria_iii" (yes/no, default: yes), e.g.
+
+  sample            treatment       location    stage   include criteria_iii
+  85-Abu_Dhabi-Egg  Abu_Dhabi-Egg   Abu_Dhabi   Egg     no      yes
+
+Samples have to be listed in the same order as they appear in the compiled
+table, and are named after their cov files (../meth_extract_covs/
+${sample}.cov.gz). Excluded samples are ignored in all criteria, and not
+written out. Treatments with multiple included samples (replicates) are used
+in criteria III; samples with criteria_iii == no are left out of their
+treatment there, but are otherwise included.
+
+The sheet for this dataset is `sample_sheet.tsv`, which reproduces the
+published position set: the original version of this script hardcoded the
+criteria III groups, and only checked L5-AD and L6-AD of the last larval
+group (E8 x S7), hence L4-AD has criteria_iii == no. The stricter
+`sample_sheet.all_larval_reps.tsv` checks all three replicates (L4-AD to
+L6-AD), so a few positions of the published set no longer pass.
+
 The script reads in positions considered bona fide ("filter_miscalled_Cs.py" 
 ran on "all.pre-filtered.merged.cov"), then filters out positions that are not
 in this file. (criteria IV).
@@ -16,143 +37,232 @@ in this file. (criteria IV).
 The script then checks the table of all potential SNPs (in the Bis-SNP folder)
 to remove methylated positions that might be a potential SNP.
 
-Afterwards, the script reads in meth_extract_covs/*.cov files, filters out 
-unwanted positions, and saves the filtered files as ${a/cov/filt.cov} files.
+Afterwards, the script reads in meth_extract_covs/*.cov files of included
+samples, filters out unwanted positions, and saves the filtered files as
+${a/cov/filt.cov} files (or ${a/cov/filt.cov.gz} with --gzip). Files are
+filtered in parallel with --jobs, each job reading --block-size bytes at a
+time, so peak memory grows with both.
 """
+import argparse
 import csv
-import glob
 import gzip
-import statistics
+import multiprocessing
+import os
 import sys
 
 import numpy as np
-
-def lazy_int(string):
-    string = string.strip()
-    return int(string) if string else 0
+import pandas as pd
 
 def calc_cols(input_list):
     return sum([1 for x in input_list if x])
 
-# bit topsy-turvy, but start with criteria IV first!
-print ('Checking positions that are considered bona fide (criteria IV)...', 
-       file=sys.stderr)
+def pack_keys(scafs, positions, scaf_list):
+    """
+    Packs scaffolds (as their index in scaf_list) and positions into int64
+    keys, i.e. scaf_index << 32 | pos. Keys of scaffolds that are not in
+    scaf_list are negative.
+    """
+    scaf_indices = pd.Categorical(scafs, categories=scaf_list).codes
+    return (scaf_indices.astype(np.int64) << 32) | \
+           np.asarray(positions, dtype=np.int64)
 
-# bona_fide_pos[scaf][pos]: 1 == bona fide; 0 == not bona fide
-bona_fide_pos = {}
-tsv_reader = csv.reader(gzip.open('all.bona_fide_meth_pos.cov.gz', 'rt'),
-                        delimiter='\t')
+def find_keys(keys, sorted_keys):
+    """
+    Looks up keys in sorted_keys via binary search. Returns the indices of
+    keys in sorted_keys, and a boolean mask of keys that were found.
+    """
+    idx = np.searchsorted(sorted_keys, keys)
+    found = idx < len(sorted_keys)
+    found[found] = sorted_keys[idx[found]] == keys[found]
+    return idx, found
 
-for row in tsv_reader:
-    scaf = row[0]
-    pos = int(row[1])
+def filter_cov(task):
+    """
+    Writes rows in cov_file with positions in filt_keys to output_file. Rows
+    are read, looked up and written in blocks of ~block_size bytes.
+    """
+    cov_file, output_file, scaf_list, filt_keys, block_size = task
+    
+    if output_file[-2:] == 'gz':
+        o = gzip.open(output_file, 'wt', compresslevel=6)
+    else:
+        o = open(output_file, 'w')
+    
+    with gzip.open(cov_file, 'rt') as f, o:
+        while True:
+            lines = f.readlines(block_size)
+            if not lines: break
+            
+            lines = [x if x[-1] == '\n' else x + '\n'
+                     for x in lines if x.strip()]
+            if not lines: continue
+            
+            rows = [x.split('\t', 2) for x in lines]
+            keys = pack_keys([x[0] for x in rows], [int(x[1]) for x in rows],
+                             scaf_list)
+            _, found = find_keys(keys, filt_keys)
+            o.write(''.join([x for x, y in zip(lines, found) if y]))
     
-    if scaf not in bona_fide_pos:
-        scaf_size = int(scaf.split('size')[-1])
-        # scaf_size, due to gap filling etc, tend to be MERELY SUGGESTIVE of
-        # the actual length. the scaffolds are usually longer than labelled.
-        # to counter this: create an array twice the expected length
-        bona_fide_pos[scaf] = np.zeros(scaf_size * 2, dtype=np.int8)
+    return cov_file
+
+def read_sample_sheet(sample_sheet):
+    """
+    Reads sample sheet into a list of dicts (one per sample), in file order.
+    """
+    tsv_reader = csv.DictReader(sample_sheet, delimiter='\t')
+    return [row for row in tsv_reader if row['sample']]
+
+parser = argparse.ArgumentParser(description="""
+Filters methylated positions from Bismark cov files based on five criteria.
+""")
+
+parser.add_argument('sample_sheet', metavar='sample_sheet',
+                    type=argparse.FileType('r'),
+                    help="""tsv of sample, treatment, location, stage,
+                    include (yes/no) and optionally criteria_iii (yes/no), in
+                    the same order as the compiled table.""")
+parser.add_argument('--gzip', action='store_true',
+                    help="gzip-compress filtered cov files.")
+parser.add_argument('--jobs', '-j', metavar='n_jobs', type=int, default=1,
+                    help="""filter cov files in parallel (default: 1). every
+                    job holds a block of lines (--block-size) and their split
+                    copies in memory as python strings, i.e. peak memory is
+                    roughly jobs x 8 x block size (~800 MB per job by
+                    default).""")
+parser.add_argument('--block-size', metavar='n_bytes', type=int,
+                    default=100000000,
+                    help="""bytes of cov files read, looked up and written at
+                    once per job (default: 100000000, i.e. ~100 MB).""")
+args = parser.parse_args()
+
+samples = read_sample_sheet(args.sample_sheet)
+
+# index arrays into the columns of the compiled table (one column per sample)
+# are built once, and reused in every chunk
+included_indices = np.array([n for n, s in enumerate(samples)
+                             if s['include'].lower() in ['yes', 'y']])
+included_samples = [samples[n]['sample'] for n in included_indices]
+
+# treatment_indices[treatment] = indices within the included samples
+treatment_indices = {}
+for n, i in enumerate(included_indices):
+    if (samples[i].get('criteria_iii') or 'yes').lower() not in ['yes', 'y']:
+        continue
     
-    bona_fide_pos[scaf][pos] = 1
+    treatment = samples[i]['treatment']
+    if treatment not in treatment_indices:
+        treatment_indices[treatment] = []
+
+    treatment_indices[treatment].append(n)
+
+# criteria III only considers treatments with multiple samples
+treatment_indices = {t: np.array(i) for t, i in treatment_indices.items()
+                     if len(i) > 1}
+
+# cov files of included samples are only filtered at the very end, check that
+# they exist before doing any heavy lifting
+unfilt_files = ['../meth_extract_covs/{}.cov.gz'.format(x)
+                for x in included_samples]
+missing_files = [x for x in unfilt_files if not os.path.isfile(x)]
+if missing_files:
+    parser.error('cov files of included samples not found: {}'.format(
+        ', '.join(missing_files)))
+
+compiled_table = 'compiled_coverage.pre-filt.meth_unmeth.tsv.gz'
+with gzip.open(compiled_table, 'rt') as f:
+    header = f.readline().rstrip('\n').split('\t')
+
+# columns are scaf, pos, followed by (meth, unmeth) for every sample
+if (len(header) - 2) // 2 != len(samples):
+    parser.error('sample sheet has {} samples, compiled table has {}'.format(
+        len(samples), (len(header) - 2) // 2))
+
+for s, h in zip(samples, header[2::2]):
+    # all groups are assigned by column order, so a mismatch is fatal
+    if h and s['sample'] not in h:
+        parser.error('sample "{}" does not match column "{}" of the '
+                     'compiled table, check the order of the sample '
+                     'sheet!'.format(s['sample'], h))
+
+# bit topsy-turvy, but start with criteria IV first!
+print ('Checking positions that are considered bona fide (criteria IV)...', 
+       file=sys.stderr)
+
+# bona fide positions are stored as a sorted array of packed (scaf, pos)
+# keys, with pos_state storing the state of each position:
+#   1 == bona fide; -1 == bona fide but potentially SNP (criteria V);
+#   +3 if position passes criteria I, II, III
+# i.e. positions that pass all criteria have a state of 4
+bona_fide_data = pd.read_table('all.bona_fide_meth_pos.cov.gz', header=None,
+                               usecols=[0, 1])
+scaf_list = pd.unique(bona_fide_data[0])
+pos_keys = np.unique(pack_keys(bona_fide_data[0], bona_fide_data[1],
+                               scaf_list))
+pos_state = np.ones(len(pos_keys), dtype=np.int8)
+del bona_fide_data
 
 # then deal with criteria V!
 print ('Blacklisting positions that are potentially SNPs (criteria V)...', 
        file=sys.stderr)
-tsv_reader = csv.reader(gzip.open(
-    '../genetic_contribution/bissnp/tabulated_genotypes.tsv.gz', 'rt'),
-    delimiter='\t')
-
-next(tsv_reader)
-for row in tsv_reader:
-    scaf = row[0]
-    pos = int(row[1])
-    
+genotype_chunks = pd.read_table(
+    '../genetic_contribution/bissnp/tabulated_genotypes.tsv.gz', header=None,
+    skiprows=1, usecols=[0, 1], chunksize=1000000)
+
+for chunk in genotype_chunks:
     # blacklist positions by multiplying the value of the position with -1,
     # turning bona-fide-but-potentially-SNP positions into -1
-    if scaf in bona_fide_pos:
-        bona_fide_pos[scaf][pos] *= -1
+    idx, found = find_keys(pack_keys(chunk[0], chunk[1], scaf_list), pos_keys)
+    pos_state[idx[found]] *= -1
 
-# criteria I, II, III: check compiled, pre-filtered, meth & unmeth reads
+# criteria I, II, III: check compiled, pre-filtered, meth & unmeth reads.
+# table is read in chunks, and criteria are checked for all rows in a chunk
+# at once
 print ('Checking full compiled table...', file=sys.stderr)
-tsv_reader = csv.reader(gzip.open(
-    'compiled_coverage.pre-filt.meth_unmeth.tsv.gz', 'rt'), 
-    delimiter='\t')
+compiled_chunks = pd.read_table(compiled_table, header=None, skiprows=1,
+                                chunksize=1000000)
 
-next(tsv_reader)
-for row in tsv_reader:
-    if not row: continue
-    
-    per_sample_cov = [lazy_int(i) + lazy_int(j)
-                      for i, j in zip(row[2::2], row[3::2])]
-    
-    # exclude egg sample with very few reads (index #13)
-    del per_sample_cov[13]
+for chunk in compiled_chunks:
+    # empty cells == 0 reads. excluded samples (e.g. the egg sample with very
+    # few reads) are dropped
+    reads = chunk.iloc[:, 2:].fillna(0).values.astype(np.int64)
+    per_sample_meth = reads[:, 0::2][:, included_indices]
+    per_sample_cov = per_sample_meth + reads[:, 1::2][:, included_indices]
     
     # criteria II: coverage >= 5 for all treatments
-    if not min(per_sample_cov) >= 5: continue
+    passed = per_sample_cov.min(axis=1) >= 5
     
     # criteria I: median coverage >= 10
-    if not statistics.median(per_sample_cov) >= 10: continue
+    passed &= np.median(per_sample_cov, axis=1) >= 10
     
     # criteria III: all replicates in at least one treatment with multiple
-    # samples have methylation, i.e., any of
+    # samples have methylation, e.g. any of
     # - Fujairah adult
     # - Fujairah sperm
     # - Abu Dhabi adult
     # - Abu Dhabi sperm
     # - Abu Dhabi larvae (E7 x S8)
     # - Abu Dhabi larvae (E8 x S7)
-    per_sample_meth = [lazy_int(i) for i in row[2::2]]
-    
-    # exclude egg sample with very few reads (index #13)
-    del per_sample_meth[13]
-    
-    # for this dataset, there are 6 treatments, each with 3 or 4 replicates.
-    # in the per_sample_meth array, the treatments have indices of
-    # 0,2,4,6; 1,3,5,7; 8,10,12,14; 9,11,13,16; 17,18,19; 20,21,22
-    # following lines are hacky, but whatever works!
-    one_treat_all_reps_meth = False
-    if all([per_sample_meth[0], per_sample_meth[2], per_sample_meth[4],
-            per_sample_meth[6]]): one_treat_all_reps_meth = True
-    elif all([per_sample_meth[1], per_sample_meth[3], per_sample_meth[5],
-              per_sample_meth[7]]): one_treat_all_reps_meth = True
-    elif all([per_sample_meth[8], per_sample_meth[10], per_sample_meth[12],
-              per_sample_meth[14]]): one_treat_all_reps_meth = True
-    elif all([per_sample_meth[9], per_sample_meth[11], per_sample_meth[13],
-              per_sample_meth[16]]): one_treat_all_reps_meth = True
-    elif all(per_sample_meth[17:20]): one_treat_all_reps_meth = True
-    elif all(per_sample_meth[21:23]): one_treat_all_reps_meth = True
+    one_treat_all_reps_meth = np.zeros(len(chunk), dtype=bool)
+    for t in treatment_indices.values():
+        one_treat_all_reps_meth |= (per_sample_meth[:, t] > 0).all(axis=1)
     
-    if not one_treat_all_reps_meth: continue
+    passed &= one_treat_all_reps_meth
     
-    scaf = row[0]
-    pos = int(row[1])
-    
-    if scaf in bona_fide_pos:
-        # adds 3 because it passes 3 additional criteria here
-        bona_fide_pos[scaf][pos] += 3
+    # adds 3 to bona fide positions because it passes 3 additional criteria
+    passed_rows = chunk[passed]
+    idx, found = find_keys(
+        pack_keys(passed_rows[0], passed_rows[1], scaf_list), pos_keys)
+    np.add.at(pos_state, idx[found], 3)
 
-# start filtering for correct positions
-unfilt_files = glob.glob('../meth_extract_covs/*.cov.gz')
+# pick out positions that pass criteria I-IV, and avoids the -ve
+# multiplication because of criteria V
+filt_keys = pos_keys[pos_state == 4]
 
-# exclude egg sample with very few reads ('85-Abu_Dhabi-Egg')
-unfilt_files = [x for x in unfilt_files if '85-Abu_Dhabi-Egg' not in x]
+# start filtering for correct positions in included samples
+output_suffix = 'filt.cov.gz' if args.gzip else 'filt.cov'
+tasks = [[u, u.split('/')[-1].replace('cov.gz', output_suffix), scaf_list,
+          filt_keys, args.block_size] for u in unfilt_files]
 
-for u in sorted(unfilt_files):
-    print ('Processing {}...'.format(u), file=sys.stderr)
-    
-    tsv_reader = csv.reader(gzip.open(u, 'rt'), delimiter='\t')
-    output_file = u.split('/')[-1].replace('cov.gz', 'filt.cov')
-    with open(output_file, 'w') as o:
-        for row in tsv_reader:
-            if not row: continue
-            
-            scaf = row[0]
-            pos = int(row[1])
-            
-            if scaf in bona_fide_pos:
-                # pick out positions that pass criteria I-IV, and avoids the
-                # -ve multiplication because of criteria V
-                if bona_fide_pos[scaf][pos] == 4:
-                    print ('\t'.join(row), file=o)
+with multiprocessing.Pool(args.jobs) as pool:
+    for u in pool.imap_unordered(filter_cov, tasks):
+        print ('Processed {}...'.format(u), file=sys.stderr)
@@ -6,38 +6,113 @@
 Script takes in `tabulated_genotype.tsv`, and based on `tabulated_depths.tsv`,
 prints out positions with high coverage (minimum coverage >= 10), so that
 "0/0" calls from Bis-SNP are more likely to mean homozygous reference base,
-rather than unknown due to lack of coverage.
+rather than unknown due to lack of coverage. Positions with very high coverage
+(maximum coverage > 100) are dropped too. Both thresholds can be changed with
+--min-cov and --max-cov.
 
 Script assumes that both files have headers, positions are ordered in the same
-manner, with the same number of lines.
+manner, with the same number of lines. Both tables are read in chunks of rows;
+scaffolds/positions of every chunk are checked against each other, then
+coverages of all rows in the chunk are checked at once (empty depths == 0).
+
+Alternatively, with --joint, genotypes and depths are read from a single table
+produced by `tabulate_snp_vcfs.py --depths` (depths in "DP:<file>" columns).
+Only the genotype columns are printed out. In this table, empty depths are
+unknown (samples without a call at the position, whose genotype is written as
+0) and fail the coverage check, as a 0 without coverage is exactly what this
+script is meant to weed out. Only positions with a known depth within the
+thresholds in every sample are kept, which is stricter than filtering with
+the depths of `samtools depth`, which are known for all samples.
 """
-import csv
+import argparse
+import itertools
+import sys
+
+import numpy as np
+import pandas as pd
 
-def try_int(x):
+def in_cov_window(covs, min_cov, max_cov):
     """
-    Overrides int('') to return 0, instead of crashing.
+    Returns a boolean mask of rows in the covs matrix (rows: positions,
+    columns: samples) where all samples have min_cov <= coverage <= max_cov.
+    NaN (unknown) coverages fail the check.
     """
-    try:
-        return int(x)
-    except ValueError:
-        return 0
-
-# start parsing unfiltered table
-tsv_genotypes = csv.reader(open('tabulated_genotypes.tsv'), delimiter='\t')
-tsv_depths = csv.reader(open('tabulated_depths.tsv'), delimiter='\t')
-
-# print header
-header = next(tsv_genotypes)
-print (*header, sep='\t')
-next(tsv_depths)
-
-for row in tsv_depths:
-    # read in genotypes
-    covs = [try_int(x) for x in row[2:]]
-    min_cov = min(covs)
-    max_cov = max(covs)
+    # min/max of rows with NaNs are NaN, which fails both comparisons
+    return (covs.min(axis=1) >= min_cov) & (covs.max(axis=1) <= max_cov)
+
+parser = argparse.ArgumentParser(description="""
+Filters tabulated genotypes for positions with coverage >= 10 and <= 100 in
+all samples.""")
+
+parser.add_argument('genotypes', metavar='genotypes_tsv', nargs='?',
+                    default='tabulated_genotypes.tsv',
+                    help="""table of genotypes (default:
+                    tabulated_genotypes.tsv).""")
+parser.add_argument('depths', metavar='depths_tsv', nargs='?',
+                    default='tabulated_depths.tsv',
+                    help="""table of depths, with the same rows as the table
+                    of genotypes (default: tabulated_depths.tsv).""")
+parser.add_argument('--joint', metavar='joint_table',
+                    help="""table of genotypes and depths produced by
+                    tabulate_snp_vcfs.py --depths, instead of
+                    tabulated_genotypes.tsv + tabulated_depths.tsv.""")
+parser.add_argument('--min-cov', metavar='n', type=int, default=10,
+                    help="minimum coverage in all samples (default: 10).")
+parser.add_argument('--max-cov', metavar='n', type=int, default=100,
+                    help="maximum coverage in all samples (default: 100).")
+parser.add_argument('--chunksize', metavar='n_rows', type=int,
+                    default=1000000,
+                    help="rows read per chunk (default: 1000000).")
+args = parser.parse_args()
+
+if args.joint:
+    header = pd.read_table(args.joint, nrows=0).columns.tolist()
+    gt_cols = [x for x in header[2:] if not x.startswith('DP:')]
+    depth_cols = [x for x in header[2:] if x.startswith('DP:')]
+    
+    # print header
+    print (*header[:2], *gt_cols, sep='\t')
+    
+    joint_chunks = pd.read_table(args.joint, dtype={header[0]: str},
+                                 chunksize=args.chunksize)
+    for chunk in joint_chunks:
+        # empty depths are unknown (NaN), not 0, and fail the check
+        covs = chunk[depth_cols].values.astype(np.float64)
+        passed = in_cov_window(covs, args.min_cov, args.max_cov)
+        
+        chunk.loc[passed, header[:2] + gt_cols].to_csv(
+            sys.stdout, sep='\t', header=False, index=False)
+else:
+    # print header
+    with open(args.genotypes) as f:
+        print (f.readline(), end='')
+    
+    # genotypes are kept as strings, so that selected rows are printed out
+    # exactly as they are in the table
+    genotype_chunks = pd.read_table(args.genotypes, header=None, skiprows=1,
+                                    dtype=str, keep_default_na=False,
+                                    chunksize=args.chunksize)
+    depth_chunks = pd.read_table(args.depths, header=None, skiprows=1,
+                                 dtype={0: str}, chunksize=args.chunksize)
     
-    if min_cov >= 10 and max_cov <= 100:
-        print (*next(tsv_genotypes), sep='\t')
-    else:
-        next(tsv_genotypes)
+    for gt_chunk, depth_chunk in itertools.zip_longest(genotype_chunks,
+                                                       depth_chunks):
+        if gt_chunk is None or depth_chunk is None or \
+                len(gt_chunk) != len(depth_chunk):
+            sys.exit('ERROR: {} and {} have different numbers of '
+                     'rows!'.format(args.genotypes, args.depths))
+        
+        # the rows of both tables have to refer to the same positions
+        mismatched = (gt_chunk[0].values != depth_chunk[0].values) | \
+            (gt_chunk[1].values.astype(np.int64) != depth_chunk[1].values)
+        if mismatched.any():
+            i = np.flatnonzero(mismatched)[0]
+            sys.exit('ERROR: {}:{} in {} does not match {}:{} in {}!'.format(
+                gt_chunk.iat[i, 0], gt_chunk.iat[i, 1], args.genotypes,
+                depth_chunk.iat[i, 0], depth_chunk.iat[i, 1], args.depths))
+        
+        covs = depth_chunk.iloc[:, 2:].fillna(0).values.astype(np.int64)
+        passed = in_cov_window(covs, args.min_cov, args.max_cov)
+        
+        gt_chunk[passed].to_csv(sys.stdout, sep='\t', header=False,
+                                index=False)
@@ -5,14 +5,33 @@
 
 Compiles SNPs called by Bis-SNP from multiple files, then dumps genotype
 information from all files into a giant tsv table.
+
+By default, a genotype array spanning the whole genome is created for every
+file, and every position in the genome is checked. With --sparse, only
+called positions are collected from each file; these are combined into a
+sorted union of positions, and genotypes are tabulated for these positions
+only (output is identical, but memory/time scales with the number of calls
+instead of the size of the genome).
+
+VCF files are parsed in bulk (CHROM, POS and GT columns only), in parallel
+across files with --jobs.
+
+With --depths (implies --sparse), per-sample read depths (DP in the FORMAT
+field) are parsed as well, and written next to the genotypes as "DP:<file>"
+columns, i.e. genotypes and depths of a position are on the same row. Samples
+without a call at a position (or calls without DP) have an empty depth, as
+their coverage is unknown.
 """
 import argparse
 import csv
+import functools
+import multiprocessing
 import re
 
 import numpy as np
+import pandas as pd
 
-import natural_sort
+import natural_order
 
 def convert_gt_to_int(gt_string):
     """
@@ -32,6 +51,112 @@ def convert_gt_to_int(gt_string):
     
     return sum_gt_ints
 
+def parse_vcf_gts(vcf_filename, with_depth=False):
+    """
+    Parses CHROM, POS and GT columns of all calls in the VCF file in bulk. GT
+    strings are converted to ints via a lookup table of the (few) unique GT
+    strings in the file, instead of converting them one by one.
+    
+    Returns [scaffold names, per-call indices into scaffold names, 0-based
+    positions, genotypes], followed by read depths if with_depth.
+    """
+    # commented lines are at the top of the file
+    n_comments = 0
+    with open(vcf_filename) as f:
+        for line in f:
+            if line[0] != '#': break
+            n_comments += 1
+    
+    try:
+        vcf_data = pd.read_table(vcf_filename, header=None,
+                                 skiprows=n_comments, usecols=[0, 1, 8, 9],
+                                 dtype={0: str, 1: np.int64, 8: str, 9: str})
+    except pd.errors.EmptyDataError:
+        empty = [[], np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64),
+                 np.zeros(0, dtype='int8')]
+        if with_depth:
+            empty.append(np.zeros(0, dtype=np.int32))
+        
+        return empty
+    
+    scaf_indices, scaf_names = pd.factorize(vcf_data[0])
+    gt_indices, gt_strings = pd.factorize(
+        vcf_data[9].str.split(':', n=1).str[0])
+    gt_lookup = np.array([convert_gt_to_int(x) for x in gt_strings],
+                         dtype='int8')
+    
+    # vcf files are 1-based
+    results = [list(scaf_names), scaf_indices.astype(np.int32),
+               vcf_data[1].values - 1, gt_lookup[gt_indices]]
+    
+    if with_depth:
+        # position of DP depends on the FORMAT string of the call, but there
+        # are only a few different FORMAT strings per file. calls without DP
+        # (or with DP == '.') have an unknown depth of -1
+        depths = np.full(len(vcf_data), -1, dtype=np.int32)
+        format_indices, format_strings = pd.factorize(vcf_data[8])
+        for n, f in enumerate(format_strings):
+            f = f.split(':')
+            if 'DP' not in f: continue
+            
+            calls = format_indices == n
+            dp = vcf_data[9][calls].str.split(':').str[f.index('DP')]
+            depths[calls] = pd.to_numeric(dp, errors='coerce').fillna(-1)
+        
+        results.append(depths)
+    
+    return results
+
+def tabulate_sparse(vcf_data):
+    """
+    Tabulates genotypes of positions that have non-0 genotypes in at least one
+    file, using the output of parse_vcf_gts() for every file. Positions are
+    represented as int64 keys (scaf_index << 32 | pos), where scaffolds are
+    indexed in natural order.
+    
+    Returns list of scaffolds, sorted array of keys, a genotype matrix (rows:
+    keys, columns: files) and a matching depth matrix (None if
+    parse_vcf_gts() was not run with_depth; unknown depths are -1).
+    """
+    scaf_list = natural_order.sort_scaffolds(s for d in vcf_data for s in d[0])
+    scaf_index = {s: n for n, s in enumerate(scaf_list)}
+    
+    # per_file_calls[file_index] = (sorted keys, genotypes, [depths])
+    per_file_calls = []
+    for scaf_names, scaf_indices, positions, gts, *depths in vcf_data:
+        file_scaf_index = np.array([scaf_index[s] for s in scaf_names],
+                                   dtype=np.int64)
+        keys = file_scaf_index[scaf_indices] << 32
+        keys |= positions
+        
+        # for duplicated positions, keep the last call in the file
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        last_call = np.append(keys[1:] != keys[:-1], True)
+        per_file_calls.append((keys[last_call], gts[order][last_call],
+                               [d[order][last_call] for d in depths]))
+    
+    # only positions with non-0 genotypes are tabulated, but depths of 0
+    # genotypes at these positions are still needed
+    all_keys = np.unique(np.concatenate(
+        [keys[gts != 0] for keys, gts, _ in per_file_calls]))
+    gt_matrix = np.zeros((len(all_keys), len(vcf_data)), dtype='int8')
+    depth_matrix = None
+    if len(vcf_data[0]) > 4:
+        # positions without a call in a file have an unknown depth of -1
+        depth_matrix = np.full((len(all_keys), len(vcf_data)), -1,
+                               dtype=np.int32)
+    
+    for n, (keys, gts, depths) in enumerate(per_file_calls):
+        idx = np.searchsorted(all_keys, keys)
+        found = idx < len(all_keys)
+        found[found] = all_keys[idx[found]] == keys[found]
+        gt_matrix[idx[found], n] = gts[found]
+        if depths:
+            depth_matrix[idx[found], n] = depths[0][found]
+    
+    return scaf_list, all_keys, gt_matrix, depth_matrix
+
 parser = argparse.ArgumentParser(description="""
 Compiles SNPs called by Bis-SNP from multiple files, then dumps genotype
 information from all files into a giant tsv table.""")
@@ -39,49 +164,81 @@ information from all files into a giant tsv table.""")
 parser.add_argument('vcfs', metavar='vcf_files',
                     type=argparse.FileType('r'), nargs='+',
                     help='VCFs containing coverage information.')
+parser.add_argument('--sparse', action='store_true',
+                    help="""only tabulate called positions, instead of
+                    scanning through the whole genome.""")
+parser.add_argument('--depths', action='store_true',
+                    help="""also tabulate read depths (DP) of every file as
+                    "DP:<file>" columns (implies --sparse).""")
+parser.add_argument('--jobs', '-j', metavar='n_jobs', type=int, default=1,
+                    help="parse VCF files in parallel (default: 1).")
 
 args = parser.parse_args()
 
-vcf_filenames = natural_sort.natural_sort([x.name for x in args.vcfs])
+vcf_filenames = natural_order.natural_sort([x.name for x in args.vcfs])
 
-# read styl scaffold lengths to create appropriately-sized NumPy arrays
-scaf_lens = {}
+# vcf_data[file_index] = output of parse_vcf_gts()
+with multiprocessing.Pool(args.jobs) as pool:
+    vcf_data = pool.map(functools.partial(parse_vcf_gts,
+                                          with_depth=args.depths),
+                        vcf_filenames)
 
-tsv_reader = csv.reader(open(
-    '../../raw_data/pdae_genome.v1.scaffold_lengths.tsv'), delimiter='\t')
-for row in tsv_reader:
-    if not row: continue
+if args.sparse or args.depths:
+    scaf_list, all_keys, gt_matrix, depth_matrix = tabulate_sparse(vcf_data)
     
-    scaf_lens[row[0]] = int(row[1])
-
-# chuck gt info into a dict containing many NumPy arrays
-#   gt_info[file][scaf] = convert_gt_to_int(gt_bases)
-gt_info = {}
+    if args.depths:
+        print ('scaf', 'pos', *vcf_filenames,
+               *['DP:' + x for x in vcf_filenames], sep='\t')
+        for key, pos_covs, pos_depths in zip(all_keys.tolist(),
+                                             gt_matrix.tolist(),
+                                             depth_matrix.tolist()):
+            # unknown depths are left empty
+            results = [scaf_list[key >> 32], (key & 0xffffffff) + 1] + \
+                      pos_covs + [x if x >= 0 else '' for x in pos_depths]
+            print (*results, sep='\t')
+    else:
+        print ('scaf', 'pos', *vcf_filenames, sep='\t')
+        for key, pos_covs in zip(all_keys.tolist(), gt_matrix.tolist()):
+            # remember to convert 0-based positions back to 1-based positions
+            results = [scaf_list[key >> 32], (key & 0xffffffff) + 1] + pos_covs
+            print (*results, sep='\t')
+else:
+    # read styl scaffold lengths to create appropriately-sized NumPy arrays
+    scaf_lens = {}
 
-for v in vcf_filenames:
-    gt_info[v] = {}
-    for s in scaf_lens:
-        gt_info[v][s] = np.zeros(scaf_lens[s], dtype='int8')
-    
-    tsv_reader = csv.reader(open(v), delimiter='\t')
+    tsv_reader = csv.reader(open(
+        '../../raw_data/pdae_genome.v1.scaffold_lengths.tsv'), delimiter='\t')
     for row in tsv_reader:
         if not row: continue
-        if row[0][0] == '#': continue       # ignore commented lines
-        
-        scaf = row[0]
-        pos = int(row[1]) - 1               # vcf files are 1-based
-        gt_string = row[9].split(':')[0]
-        gt_info[v][scaf][pos] = convert_gt_to_int(gt_string)
-
-# print stuff out
-print ('scaf', 'pos', *natural_sort.natural_sort(gt_info), sep='\t')
-for s in natural_sort.natural_sort(scaf_lens):
-    for n in range(scaf_lens[s]):
-        pos_covs = [gt_info[x][s][n] for x in natural_sort.natural_sort(gt_info)]
         
-        # do not print positions that are 0 coverage in all files
-        if not any(pos_covs): continue
+        scaf_lens[row[0]] = int(row[1])
+
+    # chuck gt info into a dict containing many NumPy arrays
+    #   gt_info[file][scaf] = convert_gt_to_int(gt_bases)
+    gt_info = {}
+
+    for v, (scaf_names, scaf_indices, positions, gts) in \
+            zip(vcf_filenames, vcf_data):
+        gt_info[v] = {}
+        for s in scaf_lens:
+            gt_info[v][s] = np.zeros(scaf_lens[s], dtype='int8')
         
-        # remember to convert 0-based positions back to 1-based positions
-        results = [s, n + 1] + pos_covs
-        print (*results, sep='\t')
+        # indices of calls are in file order, so later calls of duplicated
+        # positions overwrite earlier ones
+        scaf_calls = pd.Series(scaf_indices).groupby(scaf_indices).indices
+        for n, idx in scaf_calls.items():
+            gt_info[v][scaf_names[n]][positions[idx]] = gts[idx]
+
+    # print stuff out. files are sorted once, not once per position
+    gt_files = natural_order.natural_sort(gt_info)
+    print ('scaf', 'pos', *gt_files, sep='\t')
+    for s in natural_order.sort_scaffolds(scaf_lens):
+        for n in range(scaf_lens[s]):
+            pos_covs = [gt_info[x][s][n] for x in gt_files]
+            
+            # do not print positions that are 0 coverage in all files
+            if not any(pos_covs): continue
+            
+            # remember to convert 0-based positions back to 1-based positions
+            results = [s, n + 1] + pos_covs
+            print (*results, sep='\t')
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+> calc_allelic_diff.py <
+
+Calculates mean allelic differences between Fujairah and Abu Dhabi samples
+per gene (and per exon within each gene), as an alternative to Fst.
+
+The allelic difference of a position is |sum(F genotypes) - sum(AD
+genotypes)| / 8. Differences of all positions are calculated at once from the
+genotype matrix, then averaged per gene. Genes without exonic positions have
+an exonic allelic difference of 0.
+
+Output (`allelic_diff.gene.tsv`) is used by
+`plot_pairplot.allelic_diff_vs_meth.py`.
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import natural_order
+
+def group_mean(group_indices, n_groups, values):
+    """
+    Calculates the mean of values in every group, where group_indices
+    contains the group of each value. Groups without values have a mean of 0.
+    """
+    sums = np.bincount(group_indices, weights=values, minlength=n_groups)
+    counts = np.bincount(group_indices, minlength=n_groups)
+    
+    means = np.zeros(n_groups)
+    np.divide(sums, counts, out=means, where=counts > 0)
+    return means
+
+parser = argparse.ArgumentParser(description="""
+Calculates per-gene mean allelic differences between Fujairah and Abu
+Dhabi.""")
+
+parser.add_argument('--input', metavar='tsv_file',
+                    default='../bissnp/tabulated_genotypes.cov10-100.AS.annot.tsv',
+                    help="""annotated genotype table (default:
+                    ../bissnp/tabulated_genotypes.cov10-100.AS.annot.tsv).""")
+parser.add_argument('--output', metavar='tsv_file',
+                    default='allelic_diff.gene.tsv',
+                    help="output table (default: allelic_diff.gene.tsv).")
+args = parser.parse_args()
+
+# genotypes of A1-F to A4-F; S1-F to S4-F, and likewise for AD
+f_cols = [2, 3, 4, 5, 17, 18, 19, 20]
+ad_cols = [6, 7, 8, 9, 10, 11, 12, 13]
+
+genotype_data = pd.read_table(args.input, header=None, skiprows=1,
+                              usecols=sorted(set(f_cols + ad_cols)) + [25, 29],
+                              dtype={25: str, 29: str}, keep_default_na=False)
+
+# ignore intergenic positions
+genotype_data = genotype_data[
+    genotype_data[25].str.contains('PdaeGene', regex=False)]
+
+# calculate per-position mean allelic diff
+f_allelic_dist = genotype_data[f_cols].values.astype(np.int64).sum(axis=1)
+ad_allelic_dist = genotype_data[ad_cols].values.astype(np.int64).sum(axis=1)
+pos_allelic_dist = np.abs(f_allelic_dist - ad_allelic_dist) / 8
+
+# shorten annot, then average per gene
+gene_indices, genes = pd.factorize(
+    genotype_data[25].str.replace('PdaeGene', 'Pdae', regex=False))
+is_exon = genotype_data[29].str.contains('Exon_', regex=False).values
+
+allelic_diff = pd.DataFrame(index=pd.Index(genes, name='gene'))
+allelic_diff['ad_gene'] = group_mean(gene_indices, len(genes),
+                                     pos_allelic_dist)
+allelic_diff['ad_exon'] = group_mean(gene_indices[is_exon], len(genes),
+                                     pos_allelic_dist[is_exon])
+
+allelic_diff = allelic_diff.loc[natural_order.natural_sort(allelic_diff.index)]
+allelic_diff.to_csv(args.output, sep='\t')
@@ -4,30 +4,45 @@
 > calc_hudson_fst.py <
 
 Based on the output of BisSNP analysis, calculate the numerators and
-denominators of Hudson's Fst (as formulated by Bhatia et. al, 2013) 
+denominators of Hudson's Fst (as formulated by Bhatia et. al, 2013)
 for every consistent position.
 
-Equation 10 from the publication was used to calculate the numerators and 
+Equation 10 from the publication was used to calculate the numerators and
 denominators. The reason why both are calculated separately is because the same
-publication recommends the calculation of Fst in a window containing multiple 
+publication recommends the calculation of Fst in a window containing multiple
 SNPs as the ratio of averages (i.e. sum N / sum D) instead of average of ratios
 (i.e. mean (N/D)).
 
-Hudson Fst values are saved directly into `hudson_fsts.tsv`.
+Numerators and denominators are calculated for all positions at once, from the
+genotype matrix of the table. By default, they are saved into
+`hudson_fsts.tsv` (rounded to 4 decimal places). Ratios of averages can also
+be calculated directly, skipping the (large) per-position table:
+  --genes: per-gene and per-exon Fsts, as in `tabulate_data_per_gene.py`
+  --windows: Fsts of sliding windows along each scaffold (--window-size,
+             --window-step)
+Ratios of averages are calculated from the rounded numerators/denominators, so
+that they are identical to those calculated from `hudson_fsts.tsv`.
 """
-import csv
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import fst_ratio
+import natural_order
 
 def calc_numerator(p1, p2, n1, n2):
     """
     Refer to equation 10 of the publication!
     
-    If negative values are calculated, convert that to 0 as negative Fst 
-    makes no sense.
+    If negative values are calculated, convert that to 0 as negative Fst
+    makes no sense. Returns a list, where converted values are int 0 (as in
+    the original per-position loop), so that they are written out as '0'.
     """
     a = (p1 - p2) ** 2
     b = (p1 * (1 - p1)) / (n1 - 1)
     c = (p2 * (1 - p2)) / (n2 - 1)
-    return max(a - b - c, 0)
+    return [max(x, 0) for x in (a - b - c).tolist()]
 
 def calc_denominator(p1, p2):
     """
@@ -35,45 +50,133 @@ def calc_denominator(p1, p2):
     """
     return p1 * (1 - p2) + p2 * (1 - p1)
 
-# start parsing unfiltered table
-tsv_reader = csv.reader(open('../bissnp/tabulated_genotypes.cov10-100.AS.annot.tsv'), 
-                        delimiter='\t')
-
-# print header
-with open('hudson_fsts.tsv', 'w') as output_file:
-    old_header = next(tsv_reader)
-    # 'ei' stores exon/intron information
-    print (*old_header[:2], 'gene', 'ei', 'N', 'D', sep='\t', file=output_file)
+def calc_windows(scafs, positions, N, D, window_size, window_step):
+    """
+    Calculates ratios of averages in sliding windows (1-based, inclusive
+    coordinates) of window_size bp every window_step bp along each scaffold.
+    Windows without positions with D > 0 are skipped.
     
-    for row in tsv_reader:
-        if not row: continue
-        
-        f_genotypes = [int(x) for x in row[2:6] + row[17:21]]
-        ad_genotypes = [int(x) for x in row[6:10] + row[21:25]]
-        
-        # rename PdaeGeneX to PdaeX
-        gene = row[25].replace('Gene', '')
-        
-        # if genic, check whether exon or intron
-        if 'Pdae' in row[25]:
-            if 'Exon_' in row[29]:
-                ei = 'exon'
-            elif 'Intron_' in row[29]:
-                ei = 'intron'
-        else:
-            ei = 'intergenic'
+    Returns a DataFrame with the columns scaf, start, end, n_snp and fst.
+    """
+    windows = []
+    for s, idx in pd.Series(scafs).groupby(scafs, sort=False).indices.items():
+        idx = idx[np.argsort(positions[idx], kind='stable')]
+        scaf_pos = positions[idx]
         
-        # refresher for genotype: 0 = homozygous reference base
-        #                         1 = heterozygous
-        #                         2 = homozygous non-reference base
-        # hence the proportion of non-ref base = sum(genotype) / (2 * n)
-        n1 = len(f_genotypes)
-        n2 = len(ad_genotypes)
-        p1 = sum(f_genotypes) / (2 * n1)
-        p2 = sum(ad_genotypes) / (2 * n2)
+        # window sums are differences between cumulative sums at the window
+        # boundaries
+        cum_n = np.concatenate([[0], np.cumsum(N[idx])])
+        cum_d = np.concatenate([[0], np.cumsum(D[idx])])
+        cum_snp = np.concatenate([[0], np.cumsum(D[idx] > 0)])
         
-        N = calc_numerator(p1, p2, n1, n2)
-        D = calc_denominator(p1, p2)
+        starts = np.arange(1, scaf_pos[-1] + 1, window_step)
+        ends = starts + window_size - 1
+        lo = np.searchsorted(scaf_pos, starts, side='left')
+        hi = np.searchsorted(scaf_pos, ends, side='right')
         
-        print (*row[:2], gene, ei, round(N, 4), round(D, 4), sep='\t',
+        n = cum_snp[hi] - cum_snp[lo]
+        has_snps = n > 0
+        lo, hi = lo[has_snps], hi[has_snps]
+        windows.append(pd.DataFrame({
+            'scaf': s, 'start': starts[has_snps], 'end': ends[has_snps],
+            'n_snp': n[has_snps],
+            'fst': (cum_n[hi] - cum_n[lo]) / (cum_d[hi] - cum_d[lo])}))
+    
+    return pd.concat(windows, ignore_index=True)
+
+parser = argparse.ArgumentParser(description="""
+Calculates numerators and denominators of Hudson's Fst between Fujairah and
+Abu Dhabi for every SNP, and optionally ratios of averages per gene/window.""")
+
+parser.add_argument('--input', metavar='tsv_file',
+                    default='../bissnp/tabulated_genotypes.cov10-100.AS.annot.tsv',
+                    help="""annotated genotype table (default:
+                    ../bissnp/tabulated_genotypes.cov10-100.AS.annot.tsv).""")
+parser.add_argument('--snps', metavar='tsv_file', default='hudson_fsts.tsv',
+                    help="""output file of per-SNP numerators and denominators
+                    (default: hudson_fsts.tsv).""")
+parser.add_argument('--no-snps', action='store_true',
+                    help="do not write out per-SNP numerators/denominators.")
+parser.add_argument('--genes', metavar='tsv_file',
+                    help="output file of per-gene and per-exon Fsts.")
+parser.add_argument('--windows', metavar='tsv_file',
+                    help="output file of Fsts in sliding windows.")
+parser.add_argument('--window-size', metavar='bp', type=int, default=10000,
+                    help="size of sliding windows (default: 10000).")
+parser.add_argument('--window-step', metavar='bp', type=int, default=None,
+                    help="""distance between the starts of sliding windows
+                    (default: window size, i.e. non-overlapping).""")
+args = parser.parse_args()
+
+# genotype columns of Fujairah and Abu Dhabi samples, gene and annotation
+f_cols = list(range(2, 6)) + list(range(17, 21))
+ad_cols = list(range(6, 10)) + list(range(21, 25))
+
+header = pd.read_table(args.input, nrows=0).columns.tolist()
+genotype_data = pd.read_table(args.input, header=None, skiprows=1,
+                              usecols=[0, 1] + f_cols + ad_cols + [25, 29],
+                              dtype={0: str, 1: str, 25: str, 29: str},
+                              keep_default_na=False)
+
+# refresher for genotype: 0 = homozygous reference base
+#                         1 = heterozygous
+#                         2 = homozygous non-reference base
+# hence the proportion of non-ref base = sum(genotype) / (2 * n)
+n1 = len(f_cols)
+n2 = len(ad_cols)
+p1 = genotype_data[f_cols].values.astype(np.int64).sum(axis=1) / (2 * n1)
+p2 = genotype_data[ad_cols].values.astype(np.int64).sum(axis=1) / (2 * n2)
+
+# rounding is done as in the original per-position loop (round(x, 4)), so
+# that ratios of averages match those from hudson_fsts.tsv. the rounded lists
+# are written out as they are
+N_values = [round(x, 4) for x in calc_numerator(p1, p2, n1, n2)]
+D_values = [round(x, 4) for x in calc_denominator(p1, p2).tolist()]
+N = np.array(N_values, dtype=np.float64)
+D = np.array(D_values, dtype=np.float64)
+
+# rename PdaeGeneX to PdaeX
+genes = genotype_data[25].str.replace('Gene', '', regex=False)
+
+# if genic, check whether exon or intron. genic positions that are neither
+# take the annotation of the previous position, as in the per-position loop
+genic = genotype_data[25].str.contains('Pdae', regex=False).values
+ei = pd.Series(np.select(
+    [genotype_data[29].str.contains('Exon_', regex=False).values,
+     genotype_data[29].str.contains('Intron_', regex=False).values],
+    ['exon', 'intron'], default=None), dtype=object)
+ei[~genic] = 'intergenic'
+ei = ei.ffill()
+
+if not args.no_snps:
+    with open(args.snps, 'w') as output_file:
+        # 'ei' stores exon/intron information
+        print (*header[:2], 'gene', 'ei', 'N', 'D', sep='\t',
                file=output_file)
+        output_file.write(''.join(
+            '\t'.join(map(str, row)) + '\n' for row in zip(
+                genotype_data[0], genotype_data[1], genes, ei,
+                N_values, D_values)))
+
+if args.genes:
+    # only genic positions are binned into genes
+    gene_indices, gene_names = pd.factorize(genes[genic])
+    gene_N, gene_D = N[genic], D[genic]
+    is_exon = (ei[genic] == 'exon').values
+    
+    fst_data = pd.DataFrame(index=pd.Index(gene_names, name='gene'))
+    fst_data['n_snp_gene'], fst_data['fst_gene'] = \
+        fst_ratio.ratio_of_avg(gene_indices, len(gene_names), gene_N, gene_D)
+    fst_data['n_snp_exon'], fst_data['fst_exon'] = \
+        fst_ratio.ratio_of_avg(gene_indices[is_exon], len(gene_names),
+                               gene_N[is_exon], gene_D[is_exon])
+    
+    fst_data = fst_data.loc[natural_order.natural_sort(fst_data.index)]
+    fst_data.to_csv(args.genes, sep='\t')
+
+if args.windows:
+    window_step = args.window_step or args.window_size
+    window_data = calc_windows(genotype_data[0].values,
+                               genotype_data[1].values.astype(np.int64),
+                               N, D, args.window_size, window_step)
+    window_data.to_csv(args.windows, sep='\t', index=False)
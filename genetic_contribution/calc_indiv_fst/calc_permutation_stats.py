@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+"""
+> calc_permutation_stats.py <
+
+Calculates empirical p-values and confidence intervals of the Pearson
+correlations plotted by `plot_pairplot.fst_vs_meth.py` (genetic variables vs.
+methylation variables in `delta_meth_vs_fst.gene.tsv`), as the r values are
+weak (~0.1) and the p-values of scipy.stats.pearsonr assume normality.
+
+p-values are obtained by shuffling gene labels of the methylation variables
+(--permutations times), confidence intervals by resampling genes with
+replacement (--bootstraps times). Correlations of all x_vars vs. all y_vars
+are calculated at once as matrix products, for a batch of permutations/
+bootstraps at a time; batches are processed in parallel with --jobs. Every
+batch has its own random seed (derived from --seed), so results do not depend
+on the number of jobs.
+"""
+import argparse
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+def standardise(x):
+    """
+    Centres every column of x (axis -2 is genes), and scales it to unit norm,
+    so that the Pearson correlation of two columns is their dot product.
+    """
+    x = x - x.mean(axis=-2, keepdims=True)
+    return x / np.sqrt((x ** 2).sum(axis=-2, keepdims=True))
+
+def corr_matrix(x, y):
+    """
+    Returns Pearson correlations of all columns of x vs. all columns of y
+    (rows are genes). Leading dimensions (e.g. permutations) are batched.
+    """
+    return np.matmul(np.swapaxes(standardise(x), -1, -2), standardise(y))
+
+def resample_batch(task):
+    """
+    Calculates correlation matrices for a batch of permutations (gene labels
+    of y shuffled) or bootstraps (genes resampled with replacement). Returns
+    an array of shape (batch_size, n_x_vars, n_y_vars).
+    """
+    x, y, mode, batch_size, seed = task
+    rng = np.random.default_rng(seed)
+    n_genes = len(x)
+    
+    if mode == 'permutation':
+        # shuffling does not change means/norms, so both x and y only have to
+        # be standardised once
+        idx = rng.permuted(np.tile(np.arange(n_genes), (batch_size, 1)),
+                           axis=1)
+        return np.matmul(standardise(x).T, standardise(y)[idx])
+    else:
+        # a bootstrap is represented by the number of times each gene is
+        # drawn, so that (weighted) moments of all bootstraps in the batch
+        # are matrix products. x and y are centred beforehand for stability
+        idx = rng.integers(0, n_genes, size=(batch_size, n_genes))
+        idx += np.arange(batch_size)[:, None] * n_genes
+        weights = np.bincount(idx.ravel(), minlength=batch_size * n_genes)
+        weights = weights.reshape(batch_size, n_genes) / n_genes
+        x = x - x.mean(axis=0)
+        y = y - y.mean(axis=0)
+        mean_x = weights @ x
+        mean_y = weights @ y
+        var_x = weights @ x ** 2 - mean_x ** 2
+        var_y = weights @ y ** 2 - mean_y ** 2
+        cov_xy = (weights @ (x[:, :, None] * y[:, None, :]).reshape(
+            n_genes, -1)).reshape(batch_size, x.shape[1], y.shape[1])
+        cov_xy -= mean_x[:, :, None] * mean_y[:, None, :]
+        return cov_xy / np.sqrt(var_x[:, :, None] * var_y[:, None, :])
+
+def run_batches(x, y, mode, n_resamples, batch_size, seed_seq, pool):
+    """
+    Splits n_resamples into batches of batch_size, and runs them in pool.
+    Returns an array of shape (n_resamples, n_x_vars, n_y_vars).
+    """
+    batch_sizes = [batch_size] * (n_resamples // batch_size)
+    if n_resamples % batch_size:
+        batch_sizes.append(n_resamples % batch_size)
+    
+    tasks = [[x, y, mode, b, s] for b, s in
+             zip(batch_sizes, seed_seq.spawn(len(batch_sizes)))]
+    return np.concatenate(pool.map(resample_batch, tasks))
+
+parser = argparse.ArgumentParser(description="""
+Calculates permutation p-values and bootstrap confidence intervals of the
+correlations between genetic and methylation variables.""")
+
+parser.add_argument('--input', metavar='tsv_file',
+                    default='delta_meth_vs_fst.gene.tsv',
+                    help="""per-gene table (default:
+                    delta_meth_vs_fst.gene.tsv).""")
+parser.add_argument('--output', metavar='tsv_file',
+                    default='delta_meth_vs_fst.gene.perm_stats.tsv',
+                    help="""output table (default:
+                    delta_meth_vs_fst.gene.perm_stats.tsv).""")
+parser.add_argument('--x-vars', metavar='column', nargs='+',
+                    default=['n_snp_gene', 'fst_gene', 'n_snp_exon',
+                             'fst_exon'],
+                    help="genetic variables (default: as in the pairplot).")
+parser.add_argument('--y-vars', metavar='column', nargs='+',
+                    default=['n_meth', 'delta_meth'],
+                    help="methylation variables (default: as in the pairplot).")
+parser.add_argument('--min-snps', metavar='n', type=int, default=10,
+                    help="minimum n_snp_gene of genes (default: 10).")
+parser.add_argument('--signed', action='store_true',
+                    help="""use delta_meth as is, instead of its absolute
+                    value.""")
+parser.add_argument('--permutations', metavar='n', type=int, default=10000,
+                    help="number of permutations (default: 10000).")
+parser.add_argument('--bootstraps', metavar='n', type=int, default=10000,
+                    help="number of bootstraps (default: 10000).")
+parser.add_argument('--ci', metavar='pct', type=float, default=95,
+                    help="confidence level of intervals (default: 95).")
+parser.add_argument('--batch-size', metavar='n', type=int, default=100,
+                    help="""permutations/bootstraps per batch (default:
+                    100).""")
+parser.add_argument('--seed', metavar='int', type=int, default=1,
+                    help="random seed (default: 1).")
+parser.add_argument('--jobs', '-j', metavar='n_jobs', type=int, default=1,
+                    help="process batches in parallel (default: 1).")
+args = parser.parse_args()
+
+if args.permutations < 1 or args.bootstraps < 1:
+    parser.error('--permutations and --bootstraps have to be >= 1')
+
+# read data, then filter out rows with too few SNPs within gene, as in the
+# pairplot
+data = pd.read_table(args.input, index_col=0)
+data = data[data['n_snp_gene'] >= args.min_snps]
+if not args.signed:
+    data['delta_meth'] = abs(data['delta_meth'])
+
+x = data[args.x_vars].values.astype(np.float64)
+y = data[args.y_vars].values.astype(np.float64)
+observed_r = corr_matrix(x, y)
+
+seed_seq = np.random.SeedSequence(args.seed)
+perm_seq, boot_seq = seed_seq.spawn(2)
+with multiprocessing.Pool(args.jobs) as pool:
+    perm_r = run_batches(x, y, 'permutation', args.permutations,
+                         args.batch_size, perm_seq, pool)
+    boot_r = run_batches(x, y, 'bootstrap', args.bootstraps,
+                         args.batch_size, boot_seq, pool)
+
+# two-sided empirical p-values, counting the observed correlation as one of
+# the permutations (so p is never 0)
+n_extreme = (np.abs(perm_r) >= np.abs(observed_r) - 1e-12).sum(axis=0)
+perm_p = (n_extreme + 1) / (args.permutations + 1)
+
+# percentile confidence intervals
+alpha = (100 - args.ci) / 2
+ci_low, ci_high = np.nanpercentile(boot_r, [alpha, 100 - alpha], axis=0)
+
+results = []
+for i, x_var in enumerate(args.x_vars):
+    for j, y_var in enumerate(args.y_vars):
+        _, pearson_p = scipy.stats.pearsonr(x[:, i], y[:, j])
+        results.append([x_var, y_var, len(data), observed_r[i, j], pearson_p,
+                        perm_p[i, j], ci_low[i, j], ci_high[i, j]])
+
+results = pd.DataFrame(results, columns=[
+    'x_var', 'y_var', 'n_genes', 'r', 'pearson_p', 'perm_p',
+    'ci_low', 'ci_high'])
+results.to_csv(args.output, sep='\t', index=False, float_format='%.5g')
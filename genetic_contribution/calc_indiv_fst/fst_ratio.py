@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+"""
+> fst_ratio.py <
+
+Calculates Hudson's Fst of groups of positions (genes, exons, windows) as the
+ratio of averages of per-position numerators and denominators (i.e.
+sum N / sum D), as recommended by Bhatia et al., 2013. Shared by
+`calc_hudson_fst.py` and `tabulate_data_per_gene.py`, so that per-gene Fsts
+are calculated the same way no matter which script produces them.
+
+Typical usage:
+  import fst_ratio
+  n_snps, fsts = fst_ratio.ratio_of_avg(gene_indices, n_genes, N, D)
+"""
+import numpy as np
+
+def ratio_of_avg(group_indices, n_groups, N, D):
+    """
+    Calculates the ratio of averages (sum N / sum D) of every group, where
+    group_indices contains the group of each position. Returns the number of
+    positions with D > 0 in each group, and the ratio of averages (0 if there
+    are no such positions). Positions with a negative group index (e.g.
+    intergenic SNPs, which pd.factorize() codes as -1) are ignored.
+    """
+    in_group = group_indices >= 0
+    group_indices, N, D = group_indices[in_group], N[in_group], D[in_group]
+    
+    sum_n = np.bincount(group_indices, weights=N, minlength=n_groups)
+    sum_d = np.bincount(group_indices, weights=D, minlength=n_groups)
+    n = np.bincount(group_indices, weights=D > 0, minlength=n_groups)
+    
+    ratios = np.zeros(n_groups)
+    np.divide(sum_n, sum_d, out=ratios, where=n > 0)
+    return n.astype(int), ratios
@@ -5,11 +5,9 @@
 
 Plots a pairplot using seaborn to show the correlation between all genetic
 variables vs. all methylation variables; but instead of using Fst, use 
-mean allelic frequency differences.
+mean allelic frequency differences (calculated by `calc_allelic_diff.py`).
 """
-import csv
 import math
-import statistics
 
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -40,40 +38,13 @@ data = data[data['n_snp_gene'] >= 10]
 # by a different script)
 data['delta_meth'] = abs(data['delta_meth'])
 
-# calculate per-gene mean allelic differences
-gene_allelic_diff = {}
-exon_allelic_diff = {}
-tsv_reader = csv.reader(open('../bissnp/tabulated_genotypes.cov10-100.AS.annot.tsv'), 
-                        delimiter='\t')
-for row in tsv_reader:
-    # ignore intergenic positions
-    if 'PdaeGene' not in row[25]: continue
-    
-    # shorten annot
-    gene = row[25].replace('PdaeGene', 'Pdae')
-    if gene not in gene_allelic_diff:
-        gene_allelic_diff[gene] = []
-        exon_allelic_diff[gene] = []
-    
-    # sum allelic differences in A1-F to A4-F; S1-F to S4-F
-    f_allelic_dist = sum([int(row[x]) for x in [2, 3, 4, 5, 17, 18, 19, 20]])
-    
-    # likewise for AD
-    ad_allelic_dist = sum([int(row[x]) for x in [6, 7, 8, 9, 10, 11, 12, 13]])
-    
-    # calculate per-position mean allelic diff
-    pos_allelic_dist = abs(f_allelic_dist - ad_allelic_dist) / 8
-    gene_allelic_diff[gene].append(pos_allelic_dist)
-    if 'Exon_' in row[29]:
-        exon_allelic_diff[gene].append(pos_allelic_dist)
-
-# go through dict, and calculate mean per-gene allelic diffs
-gene_allelic_diff = {x:statistics.mean(y) for x, y in gene_allelic_diff.items()}
-exon_allelic_diff = {x:(statistics.mean(y) if len(y) > 0 else 0) for x, y in exon_allelic_diff.items()}
+# read per-gene mean allelic differences
+allelic_diff = pd.read_table('allelic_diff.gene.tsv', index_col=0,
+                             float_precision='round_trip')
 
-# join these dicts into the original data dataframe
-data = pd.concat([data, pd.Series(gene_allelic_diff, name='ad_gene')], axis=1, join='inner')
-data = pd.concat([data, pd.Series(exon_allelic_diff, name='ad_exon')], axis=1, join='inner')
+# join these into the original data dataframe
+data = pd.concat([data, allelic_diff['ad_gene']], axis=1, join='inner')
+data = pd.concat([data, allelic_diff['ad_exon']], axis=1, join='inner')
 
 # plot the pairplot!
 sns.set(style='ticks', font_scale=1)
@@ -5,24 +5,26 @@
 
 Parse genetic and epigenetic data into per-gene bins, each row contains one bin
 with all relevant data for future calculations.
+
+Per-gene and per-exon Fsts are calculated from `hudson_fsts.tsv` in one pass,
+by summing N and D (and counting positions with D > 0) per gene. Per-gene
+Fsts already calculated by `calc_hudson_fst.py --genes` can be used instead
+with --fst-genes.
 """
-import csv
+import argparse
 
 import pandas as pd
 
-import natural_sort
+import fst_ratio
+import sample_metadata
+
+parser = argparse.ArgumentParser(description="""
+Tabulates delta methylation and Fst of every gene.""")
 
-def fst_ratio_of_avg(list_fst_n, list_fst_d):
-    """
-    Calculates and returns the ratio of averages of the Fsts in a specific
-    window.
-    """
-    n = len(list_fst_d[list_fst_d > 0])
-    if not n:
-        return [0, 0]
-    else:
-        ratio_of_avg = sum(list_fst_n) / sum(list_fst_d)
-        return [n, ratio_of_avg]
+parser.add_argument('--fst-genes', metavar='tsv_file',
+                    help="""per-gene Fsts from calc_hudson_fst.py --genes,
+                    instead of calculating them from hudson_fsts.tsv.""")
+args = parser.parse_args()
 
 # read meth data
 meth_data = pd.read_table(
@@ -33,41 +35,52 @@ meth_data = pd.read_table(
 meth_data = meth_data[meth_data['meth pos'] >= 5]
 
 # subselect meth pos, adult and sperm samples
-meth_data = meth_data.filter(regex='^meth pos|^A|^S')
+adult_sperm = sample_metadata.group_mask(meth_data.columns, stage=['A', 'S'])
+meth_data = meth_data.loc[:, adult_sperm | (meth_data.columns == 'meth pos')]
 
 # rename 'meth pos' to 'n_meth'
 meth_data = meth_data.rename({'meth pos': 'n_meth'}, axis='columns')
 
 # retain genes that are methylated in the subselected samples
-meth_data = meth_data[meth_data.filter(regex='^A|^S').max(axis=1) > 0]
+samples = meth_data.iloc[:, sample_metadata.group_indices(meth_data.columns)]
+meth_data = meth_data[samples.max(axis=1) > 0]
 
-# use regexes to subselect groups of data
-fuj = meth_data.filter(regex='-F$')
-ad = meth_data.filter(regex='-AD$')
+# use sample metadata to subselect groups of data
+fuj = meth_data.iloc[:, sample_metadata.group_indices(meth_data.columns,
+                                                      location='F')]
+ad = meth_data.iloc[:, sample_metadata.group_indices(meth_data.columns,
+                                                     location='AD')]
 
 # calculate delta meth (as AD - F) and mean methylation of [fuj, ad]
 meth_data['delta_meth'] = ad.mean(axis=1) - fuj.mean(axis=1)
 meth_data['mean_meth'] = (fuj.mean(axis=1) + ad.mean(axis=1)) / 2
 
-# read fst data
-hudson_fsts = pd.read_table('hudson_fsts.tsv', index_col=0)
-
-# for each gene, calculate ratio of averages
-fst_data = {}
-for g in set(hudson_fsts['gene']):
-    fst_data[g] = {}
+if args.fst_genes:
+    fst_data = pd.read_table(args.fst_genes, index_col=0,
+                             float_precision='round_trip')
+else:
+    # read fst data
+    hudson_fsts = pd.read_table('hudson_fsts.tsv', index_col=0)
+    
+    # for each gene, calculate ratio of averages. positions are binned into
+    # genes once, then summed per gene (instead of scanning the whole table
+    # for every gene)
+    gene_indices, genes = pd.factorize(hudson_fsts['gene'])
+    is_exon = (hudson_fsts['ei'] == 'exon').values
+    fst_n = hudson_fsts['N'].values
+    fst_d = hudson_fsts['D'].values
+    
+    fst_data = pd.DataFrame(index=genes)
     
     # compute fst over entire gene
-    hudson_gene = hudson_fsts[hudson_fsts['gene'] == g]
-    fst_data[g]['n_snp_gene'], fst_data[g]['fst_gene'] = \
-        fst_ratio_of_avg(hudson_gene['N'], hudson_gene['D'])
+    fst_data['n_snp_gene'], fst_data['fst_gene'] = \
+        fst_ratio.ratio_of_avg(gene_indices, len(genes), fst_n, fst_d)
     
     # compute fst of exonic regions within gene
-    hudson_exon = hudson_gene[hudson_gene['ei'] == 'exon']
-    fst_data[g]['n_snp_exon'], fst_data[g]['fst_exon'] = \
-        fst_ratio_of_avg(hudson_exon['N'], hudson_exon['D'])
+    fst_data['n_snp_exon'], fst_data['fst_exon'] = \
+        fst_ratio.ratio_of_avg(gene_indices[is_exon], len(genes),
+                               fst_n[is_exon], fst_d[is_exon])
 
-fst_data = pd.DataFrame(fst_data).T
 fst_data = fst_data[['n_snp_gene', 'fst_gene', 'n_snp_exon', 'fst_exon']]
 fst_data = fst_data.astype({'n_snp_gene': int, 'fst_gene': float,
                             'n_snp_exon': int, 'fst_exon': float})
@@ -8,62 +8,624 @@ together, recompute the meth %, and leave everything else unchanged.
 
 Script is able to detect and automatically decompress files that are gzip-
 compressed (i.e. *.cov.gz).
+
+With --stream, files that are already sorted (scaffolds in natural order,
+positions ascending) are merged on the fly via a heap-based k-way merge, so
+memory use depends on the number of files instead of the number of positions.
+Files are read once; their order is checked as rows come off each file during
+the merge. If any file turns out to be unsorted, the merge is aborted, the
+(partially written) outputs are truncated and the script falls back to
+reading everything into memory. This isn't possible when reading from stdin or
+writing to a pipe, in which case the script exits with an error instead.
+Output is identical in both modes.
+
+In all modes, positions without any reads in a group (0 meth + 0 unmeth
+reads, e.g. rows with zero coverage in the input) are left out of its merged
+cov.
+
+When reading everything into memory, --numpy stores meth/unmeth reads as
+sorted arrays of packed (scaffold, position) keys and read counts (~24 bytes
+per covered position per group) instead of nested dicts (hundreds of bytes
+per position in the file).
+
+Multiple merged files can be produced from a single read of each input file
+with --groups, which takes a tsv of group names followed by the sample names
+(e.g. 'A1-F' for '../A1-F.cov') or regexes of samples in that group, e.g.
+
+  all-Adult     A.*
+  all-Fujairah  A.-F    S.-F
+
+Merged covs are then written to ${group_name}${suffix} instead of stdout.
+
+Annotated covs (e.g. produced by annotate_bismark_cov.py) have per-position
+annotations from column 7 onwards. With --annot, these columns are carried
+over to the merged covs; for each position, annotations are taken from the
+first file that contains that position.
+
+With --jobs N, scaffolds are split into partitions that are merged in
+parallel by N processes, then concatenated in natural order. This requires
+uncompressed cov files where rows of each scaffold are contiguous; an index of
+where each scaffold lies in each file is built first, so that every process
+only reads the parts of the files it needs. If files are compressed or
+scaffolds are not contiguous, the script falls back to a single process.
 """
 import argparse
 import csv
 import gzip
+import heapq
+import io
+import multiprocessing
+import os
+import re
 import sys
 
-import natural_sort
+import numpy as np
+import pandas as pd
+
+import natural_order
+
+def open_cov(filename):
+    """
+    Opens cov file for reading, decompressing it if filename ends with 'gz'.
+    argparse names stdin '<stdin>', which is passed through as-is, as are
+    file objects that are already open.
+    """
+    if not isinstance(filename, str):
+        return filename
+    elif filename == '<stdin>':
+        return sys.stdin
+    elif filename[-2:] == 'gz':
+        return gzip.open(filename, 'rt')
+    else:
+        return open(filename)
+
+def get_annot(row):
+    """
+    Returns annotation columns (column 7 onwards) of a cov row as a string,
+    or None if the row does not have annotations.
+    """
+    return '\t'.join(row[6:]) if len(row) > 6 else None
+
+class UnsortedCovError(Exception):
+    """
+    Raised by parse_cov(check_order=True) when a row of a cov file sorts
+    before the previous row.
+    """
+    pass
+
+def parse_cov(filename, with_annot=False, check_order=False):
+    """
+    Yields ((natural key of scaf, pos), scaf, meth, unmeth, annot) for every
+    row in the cov file. Natural keys of scaffolds are cached by natural_order,
+    as computing them row-by-row is costly. annot is None unless with_annot is
+    set.
+
+    With check_order, raises UnsortedCovError as soon as rows are not sorted
+    in the same order as the final output, which is a prerequisite of the
+    streaming merge.
+    """
+    tsv_reader = csv.reader(open_cov(filename), delimiter='\t')
+    prev_key = None
+    for row in tsv_reader:
+        if not row: continue
+
+        scaf = row[0]
+        sort_key = (natural_order.scaffold_key(scaf), int(row[1]))
+        annot = get_annot(row) if with_annot else None
+        if check_order:
+            if prev_key is not None and sort_key < prev_key:
+                raise UnsortedCovError(
+                    '{} is not sorted ({}:{} after {}:{})'.format(
+                        filename, scaf, row[1], prev_key[0][1], prev_key[1]))
+            prev_key = sort_key
+
+        yield (sort_key, scaf, int(row[4]), int(row[5]), annot)
+
+def get_sample_name(filename):
+    """
+    Strips folders and extensions from filename, e.g. '../A1-F.cov' --> 'A1-F'.
+    """
+    return os.path.basename(filename).split('.')[0]
+
+def read_groups(groups_file, filenames):
+    """
+    Reads a tsv where each row contains a group name, followed by one or more
+    sample names/filenames or regexes. Input files that fully match any of
+    these patterns are merged into that group.
+
+    Returns a list of [group_name, [indices of files in group]].
+    """
+    groups = []
+    tsv_reader = csv.reader(groups_file, delimiter='\t')
+    for row in tsv_reader:
+        if not row or row[0][0] == '#': continue
+
+        group_name = row[0]
+        patterns = [re.compile(x) for x in row[1:] if x]
+        file_indices = [n for n, f in enumerate(filenames)
+                        if any(p.fullmatch(get_sample_name(f)) or
+                               p.fullmatch(f) for p in patterns)]
+        groups.append([group_name, file_indices])
+
+    return groups
+
+def print_row(scaf, pos, meth, unmeth, annot=None, output_file=sys.stdout):
+    # positions without any reads (0 meth + 0 unmeth) are not covered, and
+    # are skipped in all modes
+    if not meth + unmeth: return
+
+    # recalculate meth % from the new meth + unmeth numbers
+    meth_pct = round(meth / (meth + unmeth) * 100, 4)
+
+    if annot is None:
+        print (scaf, pos, pos, meth_pct, meth, unmeth, sep='\t',
+               file=output_file)
+    else:
+        print (scaf, pos, pos, meth_pct, meth, unmeth, annot, sep='\t',
+               file=output_file)
+
+def print_progress(counter_rows):
+    if counter_rows % 1000000 == 0:
+        print ('{} rows processed...'.format(counter_rows), file=sys.stderr)
+
+def tag_rows(rows, tag):
+    """
+    Appends tag to every row yielded by rows.
+    """
+    for row in rows:
+        yield (*row, tag)
+
+def get_file_groups(groups, n_files):
+    """
+    Inverts groups (output_file, file indices) into a per-file list of the
+    groups each file contributes to.
+    """
+    file_groups = [[] for _ in range(n_files)]
+    for g, (_, file_indices) in enumerate(groups):
+        for n in file_indices:
+            file_groups[n].append(g)
+
+    return file_groups
+
+def merge_streaming(filenames, groups, with_annot=False, verbose=False):
+    """
+    k-way merges sorted cov files, printing merged positions as soon as all
+    files have moved past them.
+
+    groups is a list of (output_file, indices of files to be merged into
+    output_file); each file is read only once regardless of the number of
+    groups it belongs to.
+
+    Raises UnsortedCovError if any file turns out to be unsorted, by which
+    time some merged rows might have been written out already.
+    """
+    file_groups = get_file_groups(groups, len(filenames))
+    merged_rows = heapq.merge(*[tag_rows(parse_cov(f, with_annot, True), n)
+                                for n, f in enumerate(filenames)],
+                              key=lambda x: x[0])
+
+    def print_group_reads():
+        for g in sorted(group_reads):
+            print_row(current_scaf, current_key[1], *group_reads[g],
+                      current_annot, output_file=groups[g][0])
+
+    # group_reads[group_index] = [meth, unmeth] at the current position
+    current_key = None
+    current_annot = None
+    group_reads = {}
+    counter_rows = 0
+    for sort_key, scaf, meth, unmeth, annot, file_index in merged_rows:
+        if verbose:
+            counter_rows += 1
+            print_progress(counter_rows)
+
+        if sort_key != current_key:
+            print_group_reads()
+
+            current_key = sort_key
+            current_scaf = scaf
+            current_annot = annot
+            group_reads = {}
+        elif current_annot is None:
+            current_annot = annot
+
+        for g in file_groups[file_index]:
+            if g not in group_reads:
+                group_reads[g] = [0, 0]
+
+            group_reads[g][0] += meth
+            group_reads[g][1] += unmeth
+
+    print_group_reads()
+
+def get_offsets(groups):
+    """
+    Moves every output file of groups to its end, and returns the offsets, or
+    None for files that can't be seeked (e.g. a pipe). tell() can't be used
+    directly, as it is 0 for files opened in append mode (e.g. stdout
+    redirected with >>) until something is written.
+    """
+    return [output_file.seek(0, io.SEEK_END) if output_file.seekable()
+            else None for output_file, _ in groups]
+
+def truncate_outputs(groups, offsets):
+    """
+    Truncates the output files of groups back to offsets (see get_offsets()),
+    removing everything written since, so that they can be rewritten from
+    scratch. Anything that was already in a file (e.g. stdout opened with >>)
+    is kept. Returns False if any of them can't be seeked.
+    """
+    if None in offsets: return False
+
+    for (output_file, _), offset in zip(groups, offsets):
+        output_file.flush()
+        output_file.seek(offset)
+        output_file.truncate()
+
+    return True
+
+def merge_in_memory(filenames, groups, with_annot=False, verbose=False):
+    """
+    Reads all cov files into memory before printing merged positions. Works
+    regardless of the order of rows in the input files.
+    """
+    file_groups = get_file_groups(groups, len(filenames))
+
+    # combined_data is in the format
+    #   combined_data[group_index][scaffold][1-based_coord] = [meth, unmeth]
+    combined_data = [{} for _ in groups]
+
+    # annot_data[scaffold][1-based_coord] = annotation columns, shared across
+    # groups as annotations do not depend on the file
+    annot_data = {}
+    counter_rows = 0
+    for n, c in enumerate(filenames):
+        tsv_reader = csv.reader(open_cov(c), delimiter='\t')
+
+        for row in tsv_reader:
+            if not row: continue
+
+            if verbose:
+                counter_rows += 1
+                print_progress(counter_rows)
+
+            scaf = row[0]
+            pos = int(row[1])
+            meth = int(row[4])
+            unmeth = int(row[5])
+            if with_annot:
+                if scaf not in annot_data: annot_data[scaf] = {}
+
+                if annot_data[scaf].get(pos) is None:
+                    annot_data[scaf][pos] = get_annot(row)
+
+            for g in file_groups[n]:
+                group_data = combined_data[g]
+                if scaf not in group_data: group_data[scaf] = {}
+
+                if pos not in group_data[scaf]:
+                    group_data[scaf][pos] = [0, 0]
+
+                group_data[scaf][pos] = [group_data[scaf][pos][0] + meth,
+                                         group_data[scaf][pos][1] + unmeth]
+
+    # printing
+    for (output_file, _), group_data in zip(groups, combined_data):
+        for scaf in natural_order.sort_scaffolds(group_data):
+            for pos in sorted(group_data[scaf]):
+                annot = annot_data[scaf][pos] if with_annot else None
+                print_row(scaf, pos, *group_data[scaf][pos], annot,
+                          output_file=output_file)
+
+def sum_reads(keys, meth, unmeth):
+    """
+    Sums meth and unmeth reads of rows with identical keys.
+
+    Returns sorted distinct keys and matching int64 arrays of meth and unmeth
+    reads.
+    """
+    keys, inverse = np.unique(keys, return_inverse=True)
+
+    # weights are summed as float64, which is exact for read counts < 2 ** 53
+    meth = np.bincount(inverse.ravel(), weights=meth, minlength=len(keys))
+    unmeth = np.bincount(inverse.ravel(), weights=unmeth, minlength=len(keys))
+    return keys, meth.astype(np.int64), unmeth.astype(np.int64)
+
+def merge_numpy(filenames, groups, with_annot=False, verbose=False):
+    """
+    Like merge_in_memory(), but files are parsed in bulk into column arrays,
+    positions are packed into int64 keys (scaffold id << 32 | 1-based coord),
+    and reads of identical keys are summed with np.unique() + np.bincount().
+    Memory use is ~24 bytes per distinct position per group, independent of
+    the genome size.
+    """
+    file_groups = get_file_groups(groups, len(filenames))
+
+    # scaf_ids[scaffold] = id, in order of first appearance
+    scaf_ids = {}
+
+    # group_reads[group_index] = (sorted keys, meth, unmeth)
+    empty_reads = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                   np.zeros(0, dtype=np.int64))
+    group_reads = [empty_reads for _ in groups]
+
+    # annot_data[key] = annotation columns
+    annot_data = {}
+    counter_rows = 0
+    for n, c in enumerate(filenames):
+        try:
+            if with_annot:
+                # read everything as str, so that annotations are kept verbatim
+                cov_chunks = pd.read_table(open_cov(c), header=None,
+                                           dtype=str, na_filter=False,
+                                           chunksize=1000000)
+            else:
+                cov_chunks = pd.read_table(open_cov(c), header=None,
+                                           usecols=[0, 1, 4, 5],
+                                           dtype={0: str, 1: np.int64,
+                                                  4: np.uint32, 5: np.uint32},
+                                           chunksize=1000000)
+        except pd.errors.EmptyDataError:
+            continue
+
+        file_reads = []
+        for chunk in cov_chunks:
+            if verbose:
+                counter_rows += len(chunk)
+                print ('{} rows processed...'.format(counter_rows),
+                       file=sys.stderr)
+
+            codes, scafs = pd.factorize(chunk[0])
+            for scaf in scafs:
+                if scaf not in scaf_ids: scaf_ids[scaf] = len(scaf_ids)
+
+            ids = np.array([scaf_ids[x] for x in scafs], dtype=np.int64)
+            keys = ids[codes] << 32 | chunk[1].astype(np.int64).values
+            file_reads.append((keys, chunk[4].astype(np.uint32).values,
+                               chunk[5].astype(np.uint32).values))
+
+            if with_annot and len(chunk.columns) > 6:
+                # annotations seen earlier take precedence
+                annots = chunk[6].str.cat(
+                    [chunk[x] for x in chunk.columns[7:]], sep='\t')
+                for key, annot in zip(keys.tolist(), annots.tolist()):
+                    annot_data.setdefault(key, annot)
+
+        if not file_reads: continue
+
+        # add the reads of the file to the running totals of its groups
+        file_reads = [np.concatenate(x) for x in zip(*file_reads)]
+        for g in file_groups[n]:
+            group_reads[g] = sum_reads(
+                *[np.concatenate([x, y])
+                  for x, y in zip(group_reads[g], file_reads)])
+
+    # keys sort by scaffold id, which is in order of appearance--re-key them
+    # by the natural order of scaffolds
+    scaffolds = list(scaf_ids)
+    scaf_ranks, _ = natural_order.scaffold_ordinals(scaffolds)
+
+    # printing: convert values to python ints so that meth % is rounded the
+    # same way as above
+    for (output_file, _), (keys, meth, unmeth) in zip(groups, group_reads):
+        order = np.argsort(scaf_ranks[keys >> 32] << 32 | keys & 0xffffffff,
+                           kind='stable')
+        for key, meth, unmeth in zip(keys[order].tolist(),
+                                     meth[order].tolist(),
+                                     unmeth[order].tolist()):
+            annot = annot_data.get(key) if with_annot else None
+            print_row(scaffolds[key >> 32], key & 0xffffffff, meth, unmeth,
+                      annot, output_file=output_file)
+
+def index_cov(filename):
+    """
+    Records the byte offsets of rows from each scaffold in an uncompressed cov
+    file, i.e. index[scaffold] = (start, end).
+
+    Returns None if the file is compressed/stdin (which can't be seeked), or
+    if rows of a scaffold are not contiguous.
+    """
+    if filename == '<stdin>' or filename[-2:] == 'gz':
+        return None
+
+    index = {}
+    current_scaf = None
+    offset = 0
+    with open(filename, 'rb') as f:
+        for line in f:
+            scaf = line.split(b'\t', 1)[0].strip()
+            if scaf and scaf != current_scaf:
+                if current_scaf is not None:
+                    index[current_scaf] = (start, offset)
+
+                # scaffold seen before, i.e. rows are not contiguous
+                if scaf in index: return None
+
+                current_scaf = scaf
+                start = offset
+
+            offset += len(line)
+
+    if current_scaf is not None:
+        index[current_scaf] = (start, offset)
+
+    return {scaf.decode(): coords for scaf, coords in index.items()}
+
+def merge_partition(task):
+    """
+    Worker function for --jobs: merges the rows of a subset of scaffolds,
+    located in the files at byte ranges file_ranges[file_index], and returns
+    the merged covs of each group as strings.
+    """
+    filenames, file_ranges, group_indices, with_annot, use_numpy = task
+
+    partition_files = []
+    for f, ranges in zip(filenames, file_ranges):
+        blocks = []
+        with open(f, 'rb') as cov_file:
+            for start, end in ranges:
+                cov_file.seek(start)
+                blocks.append(cov_file.read(end - start))
+
+        partition_files.append(io.StringIO(b''.join(blocks).decode()))
+
+    groups = [[io.StringIO(), file_indices] for file_indices in group_indices]
+    if use_numpy:
+        merge_numpy(partition_files, groups, with_annot)
+    else:
+        merge_in_memory(partition_files, groups, with_annot)
+
+    return [output_file.getvalue() for output_file, _ in groups]
+
+def merge_parallel(filenames, groups, jobs, with_annot=False, use_numpy=False,
+                   verbose=False):
+    """
+    Splits scaffolds into partitions of similar sizes, and merges partitions
+    across a pool of processes. Partitions are written out in natural order.
+
+    Returns False (without writing anything) if any file can't be indexed.
+    """
+    with multiprocessing.Pool(jobs) as pool:
+        indices = pool.map(index_cov, filenames)
+        unindexed_files = [f for f, index in zip(filenames, indices)
+                           if index is None]
+        if unindexed_files:
+            if verbose:
+                print ('Files are compressed or unsorted ({}), falling back to '
+                       'a single process...'.format(', '.join(unindexed_files)),
+                       file=sys.stderr)
+            return False
+
+        # scaf_sizes[scaffold] = total number of bytes across all files
+        scaf_sizes = {}
+        for index in indices:
+            for scaf, (start, end) in index.items():
+                scaf_sizes[scaf] = scaf_sizes.get(scaf, 0) + end - start
+
+        # have several partitions per process to even out the load
+        partition_size = sum(scaf_sizes.values()) / (jobs * 4)
+        partitions = [[]]
+        current_size = 0
+        for scaf in natural_order.sort_scaffolds(scaf_sizes):
+            if current_size >= partition_size:
+                partitions.append([])
+                current_size = 0
+
+            partitions[-1].append(scaf)
+            current_size += scaf_sizes[scaf]
+
+        tasks = []
+        group_indices = [file_indices for _, file_indices in groups]
+        for p in partitions:
+            file_ranges = []
+            for index in indices:
+                # adjacent scaffolds in a file are read in one go
+                ranges = []
+                for scaf in p:
+                    if scaf not in index: continue
+
+                    start, end = index[scaf]
+                    if ranges and ranges[-1][1] == start:
+                        ranges[-1][1] = end
+                    else:
+                        ranges.append([start, end])
+
+                file_ranges.append(ranges)
+
+            tasks.append([filenames, file_ranges, group_indices, with_annot,
+                          use_numpy])
+
+        # imap returns results in the order of tasks, hence output is sorted
+        for n, outputs in enumerate(pool.imap(merge_partition, tasks)):
+            for (output_file, _), merged_cov in zip(groups, outputs):
+                output_file.write(merged_cov)
+
+            if verbose:
+                print ('{} of {} partitions merged...'.format(n + 1, len(tasks)),
+                       file=sys.stderr)
+
+    return True
 
 parser = argparse.ArgumentParser(description="""
 Given vanilla/augmented bismark cov files, combine the meth and unmeth reads
 together, recompute the meth %, and leave everything else unchanged.""")
 
 parser.add_argument('cov_files', metavar="cov_files",
-                    type=argparse.FileType('r'), nargs='+', 
+                    type=argparse.FileType('r'), nargs='+',
                     help="List of cov files from Bismark.")
+parser.add_argument('--stream', action='store_true',
+                    help="""merge sorted files on the fly with bounded memory;
+                    falls back to in-memory merging if files turn out to be
+                    unsorted (errors out if that's not possible).""")
+parser.add_argument('--groups', metavar="groups_tsv",
+                    type=argparse.FileType('r'),
+                    help="""tsv of group names and sample names/regexes; writes
+                    one merged file per group instead of printing to stdout.""")
+parser.add_argument('--suffix', metavar="suffix", default='.merged.cov',
+                    help="""suffix of merged files written in --groups mode
+                    (default: '.merged.cov').""")
+parser.add_argument('--annot', action='store_true',
+                    help="""carry annotation columns (column 7 onwards) of
+                    annotated covs over to the merged covs.""")
+parser.add_argument('--numpy', action='store_true',
+                    help="""accumulate reads in sparse NumPy arrays when
+                    merging in memory.""")
+parser.add_argument('--jobs', '-j', metavar="n_jobs", type=int, default=1,
+                    help="""merge partitions of scaffolds in parallel with this
+                    many processes (default: 1).""")
 parser.add_argument('-v', action='store_true',
                     help="verbose mode, prints progress to stderr.")
 args = parser.parse_args()
 
-# combined_data is in the format
-#   combined_data[scaffold][1-based_coord] = [meth, unmeth]
-combined_data = {}
-counter_rows = 0
-for c in args.cov_files:
-    # detect whether filename ends with 'gz'
-    if c.name[-2:] == 'gz':
-        tsv_reader = csv.reader(gzip.open(c.name, 'rt'), delimiter='\t')
-    else:
-        tsv_reader = csv.reader(c, delimiter='\t')
-    
-    for row in tsv_reader:
-        if not row: continue
-        
+cov_filenames = [c.name for c in args.cov_files]
+
+# groups is a list of [output_file, [indices of files in the group]]
+if args.groups:
+    groups = read_groups(args.groups, cov_filenames)
+    for group_name, file_indices in groups:
+        if not file_indices:
+            parser.error('group "{}" does not match any input file'.format(
+                group_name))
+
         if args.v:
-            counter_rows += 1
-            if counter_rows % 1000000 == 0:
-                print ('{} rows processed...'.format(counter_rows), 
+            print ('Group {}: {}'.format(
+                       group_name,
+                       ', '.join(cov_filenames[n] for n in file_indices)),
+                   file=sys.stderr)
+
+    groups = [[open(group_name + args.suffix, 'w'), file_indices]
+              for group_name, file_indices in groups]
+else:
+    groups = [[sys.stdout, list(range(len(cov_filenames)))]]
+
+merged_in_parallel = False
+if args.jobs > 1:
+    merged_in_parallel = merge_parallel(cov_filenames, groups, args.jobs,
+                                        args.annot, args.numpy, args.v)
+
+if not merged_in_parallel:
+    merged_in_stream = False
+    if args.stream:
+        output_offsets = get_offsets(groups)
+        try:
+            merge_streaming(cov_filenames, groups, args.annot, args.v)
+            merged_in_stream = True
+        except UnsortedCovError as e:
+            # stdin can't be read twice, and rows already written to a pipe
+            # can't be taken back
+            if '<stdin>' in cov_filenames or \
+                    not truncate_outputs(groups, output_offsets):
+                sys.exit('ERROR: {}! Rerun without --stream.'.format(e))
+
+            if args.v:
+                print ('{}, falling back to in-memory merging...'.format(e),
                        file=sys.stderr)
-        
-        scaf = row[0]
-        if scaf not in combined_data: combined_data[scaf] = {}
-        
-        pos = int(row[1])
-        if pos not in combined_data[scaf]:
-            combined_data[scaf][pos] = [0, 0]
-        
-        meth = int(row[4])
-        unmeth = int(row[5])
-        combined_data[scaf][pos] = [combined_data[scaf][pos][0] + meth,
-                                    combined_data[scaf][pos][1] + unmeth]
-
-# printing
-for scaf in natural_sort.natural_sort(combined_data):
-    for pos in sorted(combined_data[scaf]):
-        # recalculate meth % from the new meth + unmeth numbers
-        meth, unmeth = combined_data[scaf][pos]
-        meth_pct = round(meth / (meth + unmeth) * 100, 4)
-        
-        print (scaf, pos, pos, meth_pct, meth, unmeth, sep='\t')
+
+    if not merged_in_stream and args.numpy:
+        merge_numpy(cov_filenames, groups, args.annot, args.v)
+    elif not merged_in_stream:
+        merge_in_memory(cov_filenames, groups, args.annot, args.v)
+
+for output_file, _ in groups:
+    if output_file is not sys.stdout:
+        output_file.close()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""
+> meth_matrix.py <
+
+Converts the per-position methylation matrix (`all.filt.pct.tsv`: scaffold,
+pos, then one column of methylation %s per sample) into a memory-mappable
+binary store, and loads it back, so that scripts do not have to re-parse the
+~1.4m-row text table every time.
+
+The store is a folder of .npy files:
+  values.npy          float32 methylation %s, positions x samples; columns
+                      (samples) are contiguous on disk
+  positions.npy       int32 positions
+  scaffold_codes.npy  int32 index of the scaffold of every position into
+                      scaffolds.npy
+  scaffolds.npy       scaffold names, in order of first appearance
+  samples.npy         sample names (the header of the table)
+
+Typical usage:
+  python3 meth_matrix.py all.filt.pct.tsv    # writes all.filt.pct.mmap/
+
+  import meth_matrix
+  data = meth_matrix.load_frame('../../all.filt.pct.mmap')
+
+load() returns read-only memory-mapped arrays; load_frame() wraps values in a
+DataFrame (sample names as columns) without copying them.
+"""
+import argparse
+import collections
+import os
+
+import numpy as np
+import pandas as pd
+
+MethMatrix = collections.namedtuple(
+    'MethMatrix', ['scaffolds', 'scaffold_codes', 'positions', 'samples',
+                   'values'])
+
+def save(store_dir, scaffolds, scaffold_codes, positions, samples, values):
+    """
+    Writes a methylation matrix into store_dir (created if it doesn't exist).
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    np.save(os.path.join(store_dir, 'scaffolds.npy'),
+            np.asarray(scaffolds, dtype=str))
+    np.save(os.path.join(store_dir, 'scaffold_codes.npy'),
+            np.asarray(scaffold_codes, dtype=np.int32))
+    np.save(os.path.join(store_dir, 'positions.npy'),
+            np.asarray(positions, dtype=np.int32))
+    np.save(os.path.join(store_dir, 'samples.npy'),
+            np.asarray(samples, dtype=str))
+    
+    # column-major, so that every sample is a contiguous block on disk
+    np.save(os.path.join(store_dir, 'values.npy'),
+            np.asfortranarray(values, dtype=np.float32))
+
+def convert(tsv_filename, store_dir):
+    """
+    Converts a methylation table (scaffold, pos, then samples) into a store.
+    """
+    with open(tsv_filename) as f:
+        samples = f.readline().rstrip('\n').split('\t')[2:]
+    
+    data = pd.read_table(tsv_filename, dtype=dict(
+        {'scaffold': str, 'pos': np.int32}, **{s: np.float32 for s in samples}))
+    scaffold_codes, scaffolds = pd.factorize(data['scaffold'])
+    save(store_dir, scaffolds, scaffold_codes, data['pos'].values, samples,
+         data[samples].values)
+
+def load(store_dir, mmap_mode='r'):
+    """
+    Loads a store as a MethMatrix of memory-mapped arrays (nothing is read
+    from disk until it is used). With mmap_mode='c', arrays can be modified
+    in memory without changing the files.
+    """
+    def load_npy(name, mmap=True):
+        return np.load(os.path.join(store_dir, name + '.npy'),
+                       mmap_mode=mmap_mode if mmap else None)
+    
+    return MethMatrix(load_npy('scaffolds', mmap=False),
+                      load_npy('scaffold_codes'), load_npy('positions'),
+                      load_npy('samples', mmap=False), load_npy('values'))
+
+def load_frame(store_dir, with_coords=False):
+    """
+    Loads a store as a DataFrame of methylation %s with one column per
+    sample, equivalent to reading columns 2 onwards of the text table (but in
+    float32). Values are a (copy-on-write) view of the memory-mapped store.
+    With with_coords, 'scaffold' (categorical) and 'pos' columns are added
+    to the front, as in the text table.
+    """
+    matrix = load(store_dir, mmap_mode='c')
+    data = pd.DataFrame(matrix.values, columns=matrix.samples, copy=False)
+    if with_coords:
+        data.insert(0, 'scaffold', pd.Categorical.from_codes(
+            matrix.scaffold_codes, matrix.scaffolds))
+        data.insert(1, 'pos', matrix.positions)
+    
+    return data
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="""
+    Converts a methylation table (e.g. all.filt.pct.tsv) into a
+    memory-mappable binary store.""")
+    
+    parser.add_argument('tsv_file', type=str,
+                        help='methylation table (scaffold, pos, samples).')
+    parser.add_argument('-o', '--output', metavar='store_dir', type=str,
+                        help="""output folder (default: name of tsv_file,
+                        with .tsv replaced by .mmap).""")
+    args = parser.parse_args()
+    
+    store_dir = args.output
+    if not store_dir:
+        store_dir = os.path.splitext(args.tsv_file)[0] + '.mmap'
+    
+    convert(args.tsv_file, store_dir)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+"""
+> natural_order.py <
+
+Sorts scaffolds/positions/keys in natural order ('scaffold2' before
+'scaffold10'), as natural_sort.natural_sort() does, but without re-splitting
+every string with a regex: natural keys are computed once per distinct
+scaffold, scaffolds are replaced by their ordinals in natural order, and
+(scaffold, position) pairs are packed into int64 keys
+(ordinal << 32 | position) that are sorted by numpy.
+
+Natural keys of scaffolds are cached in SCAFFOLD_KEYS, which is shared by all
+calls within a script, so that scaffolds are only parsed once no matter how
+many files/groups they are sorted in.
+
+Typical usage:
+  import natural_order
+  scaffolds = natural_order.sort_scaffolds(scaf_names)
+  keys, scaffolds = natural_order.packed_keys(scafs, positions)
+  order = natural_order.argsort(scafs, positions)
+  sorted_keys = natural_order.natural_sort(['scaffold10\\t5', 'scaffold2\\t7'])
+
+Strings with identical natural keys (e.g. differing only in case) are ordered
+by the strings themselves.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+SCAFFOLD_KEYS = {}
+
+def natural_key(text):
+    """
+    Sort key that orders strings the same way as natural_sort.natural_sort().
+    """
+    return [int(x) if x.isdigit() else x.lower()
+            for x in re.split('([0-9]+)', text)]
+
+def scaffold_key(scaf):
+    """
+    Same as natural_key() (with ties broken by scaf), cached in SCAFFOLD_KEYS.
+    """
+    if scaf not in SCAFFOLD_KEYS:
+        SCAFFOLD_KEYS[scaf] = (natural_key(scaf), scaf)
+    
+    return SCAFFOLD_KEYS[scaf]
+
+def sort_scaffolds(scafs):
+    """
+    Returns distinct scaffolds of scafs, in natural order.
+    """
+    return sorted(set(scafs), key=scaffold_key)
+
+def scaffold_ordinals(scafs, key=scaffold_key):
+    """
+    Returns (ordinals, scaffolds), where scaffolds are the distinct values of
+    scafs in natural order, and ordinals is an int64 array of the index of
+    every element of scafs in scaffolds.
+    """
+    codes, uniques = pd.factorize(np.asarray(scafs, dtype=object))
+    order = sorted(range(len(uniques)), key=lambda n: key(uniques[n]))
+    
+    ranks = np.empty(len(uniques), dtype=np.int64)
+    ranks[order] = np.arange(len(uniques))
+    return ranks[codes], [uniques[n] for n in order]
+
+def packed_keys(scafs, positions):
+    """
+    Returns (keys, scaffolds), where keys is an int64 array of
+    (ordinal of scaffold << 32 | position) that sorts in natural order of
+    scaffolds, then by position, and scaffolds is the list that ordinals
+    index into. Positions have to be in [0, 2 ** 32).
+    """
+    ordinals, scaffolds = scaffold_ordinals(scafs)
+    return ordinals << 32 | np.asarray(positions, dtype=np.int64), scaffolds
+
+def argsort(scafs, positions):
+    """
+    Returns indices that (stably) sort rows by scaffold in natural order, then
+    by position.
+    """
+    keys, _ = packed_keys(scafs, positions)
+    return np.argsort(keys, kind='stable')
+
+def natural_sort(strings):
+    """
+    Drop-in replacement for natural_sort.natural_sort(), with ties (strings
+    with identical natural keys) ordered by the strings themselves. Strings
+    that end with a tab-separated integer (e.g. 'scaffold\tpos' keys) are
+    sorted by the natural key of the part before the integer, then by the
+    integer, which is the order of natural keys of the whole strings (unless
+    integers have leading zeros, or the part before contains tabs); other
+    strings are sorted by natural keys, computed once per string.
+    """
+    strings = np.array(list(strings), dtype=object)
+    
+    # str.rpartition() returns tuples, which are much cheaper to create than
+    # the lists returned by str.rsplit()
+    split_strings = [x.rpartition('\t') for x in strings]
+    prefixes = [x[0] for x in split_strings]
+    suffixes = [x[2] for x in split_strings]
+    if len(strings) and all(x[1] for x in split_strings) and \
+            all(map(str.isdigit, suffixes)):
+        order = _sort_prefixed_ints(strings, prefixes, suffixes)
+        if order is not None:
+            return strings[order].tolist()
+    
+    # don't cache keys of arbitrary strings, there could be millions of them
+    ordinals, _ = scaffold_ordinals(strings,
+                                    key=lambda x: (natural_key(x), x))
+    return strings[np.argsort(ordinals, kind='stable')].tolist()
+
+def _sort_prefixed_ints(strings, prefixes, suffixes):
+    """
+    Returns indices that sort strings (prefix + '\t' + digits) in the same
+    order as natural_sort(), or None if that can't be done without computing
+    natural keys of the whole strings.
+    """
+    codes, uniques = pd.factorize(np.asarray(prefixes, dtype=object))
+    if any('\t' in x for x in uniques): return None
+    
+    suffix_lens = np.fromiter(map(len, suffixes), dtype=np.int64,
+                              count=len(suffixes))
+    if suffix_lens.max() > 18:
+        # might not fit into an int64
+        return None
+    
+    positions = np.fromiter(map(int, suffixes), dtype=np.int64,
+                            count=len(suffixes))
+    
+    # leading zeros: natural keys of the whole strings would be tied on
+    # position, then ordered by text
+    n_digits = np.searchsorted(10 ** np.arange(19, dtype=np.int64), positions,
+                               side='right')
+    if (suffix_lens != np.maximum(n_digits, 1)).any(): return None
+    
+    # the tab belongs to the last text part of the natural key of the whole
+    # string (e.g. 'scaf\t' of 'scaf\t5'), which is why prefixes are ranked
+    # by natural_key(prefix + '\t') instead of natural_key(prefix)--otherwise
+    # 'scaf\t5' would sort before 'scaf1\t5'. prefixes with identical natural
+    # keys share a rank, so that they are ordered by position first, as whole
+    # strings would be
+    prefix_keys = [natural_key(x + '\t') for x in uniques]
+    order = sorted(range(len(uniques)),
+                   key=lambda n: (prefix_keys[n], uniques[n]))
+    
+    key_ranks = np.empty(len(uniques), dtype=np.int64)
+    string_ranks = np.empty(len(uniques), dtype=np.int64)
+    rank = -1
+    for n, u in enumerate(order):
+        if not n or prefix_keys[u] != prefix_keys[order[n - 1]]:
+            rank += 1
+        
+        key_ranks[u] = rank
+        string_ranks[u] = n
+    
+    return np.lexsort((string_ranks[codes], positions, key_ranks[codes]))
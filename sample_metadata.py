@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""
+> sample_metadata.py <
+
+Parses sample names used throughout this project (e.g. A1-F, S5-AD, L3-AD,
+E8-AD) into their developmental stage, location, colony and replicate, so
+that scripts can pick out groups of samples (columns) by their metadata,
+instead of re-deriving it from the names with regexes.
+
+Sample names are <stage><number>-<location>, where
+  stage: A (adult), E (egg), S (sperm), L (larva)
+  location: F (Fujairah), AD (Abu Dhabi)
+Adult, egg and sperm samples with the same number and location come from the
+same colony (e.g. A7-AD, S7-AD); larvae are not assigned to a colony.
+
+Typical usage:
+  import sample_metadata
+  adult = sample_metadata.group_indices(data.columns, stage='A')
+  adult_meths = data.values[:, adult]
+
+Columns that are not sample names (e.g. "scaffold", "meth pos") are ignored.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+STAGES = {'A': 'Adult', 'E': 'Egg', 'S': 'Sperm', 'L': 'Larva'}
+LOCATIONS = {'F': 'Fujairah', 'AD': 'Abu Dhabi'}
+
+SAMPLE_REGEX = re.compile(r'^([AESL])(\d+)-(F|AD)$')
+
+def parse_sample_name(name):
+    """
+    Parses a sample name into a dict of stage, location, colony and
+    replicate. Returns None if name is not a sample name.
+    """
+    match = SAMPLE_REGEX.match(str(name))
+    if not match:
+        return None
+    
+    stage, replicate, location = match.groups()
+    colony = None if stage == 'L' else '{}-{}'.format(replicate, location)
+    return {'stage': stage, 'location': location, 'colony': colony,
+            'replicate': int(replicate)}
+
+def sample_table(names):
+    """
+    Parses sample names into a table (one row per sample name, in the order
+    of names) with the columns stage, location, colony and replicate.
+    Non-sample names are dropped.
+    """
+    parsed = {n: parse_sample_name(n) for n in names}
+    table = pd.DataFrame.from_dict(
+        {n: p for n, p in parsed.items() if p is not None}, orient='index',
+        columns=['stage', 'location', 'colony', 'replicate'])
+    return table.astype({'stage': pd.CategoricalDtype(list(STAGES)),
+                         'location': pd.CategoricalDtype(list(LOCATIONS)),
+                         'replicate': int})
+
+def group_mask(names, **criteria):
+    """
+    Returns a boolean mask of names that are sample names matching all
+    criteria, e.g. group_mask(names, stage=['A', 'S'], location='F'). Values
+    of criteria can be single values or lists of values.
+    """
+    parsed = [parse_sample_name(n) for n in names]
+    mask = np.array([p is not None for p in parsed], dtype=bool)
+    for field, values in criteria.items():
+        if isinstance(values, str) or not hasattr(values, '__iter__'):
+            values = [values]
+        
+        mask &= [p is not None and p[field] in values for p in parsed]
+    
+    return mask
+
+def group_indices(names, **criteria):
+    """
+    Same as group_mask(), but returns an array of the indices of matching
+    names (e.g. for numpy column indexing, or DataFrame.iloc).
+    """
+    return np.flatnonzero(group_mask(names, **criteria))
+
+def sample_label(name):
+    """
+    Human-readable sample type of a sample name, e.g. "Fujairah Adult".
+    """
+    parsed = parse_sample_name(name)
+    return '{} {}'.format(LOCATIONS[parsed['location']],
+                          STAGES[parsed['stage']])
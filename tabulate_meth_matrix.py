@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+"""
+> tabulate_meth_matrix.py <
+
+Tabulates the methylation %s (column 4) of bismark cov files into a single
+matrix of positions x samples (e.g. all.filt.pct.tsv), i.e. the outer join of
+all files on (scaffold, pos). Positions absent from a file are left empty.
+
+Output is identical to
+  tabulate_tsvs.py *.cov -k 0 1 -c 3 > all.filt.pct.tsv
+followed by adding "scaffold" and "pos" to the header and removing ".cov" from
+sample names, but positions are joined as sorted integer keys (scaffold
+ordinal in natural order, then pos) instead of in a dict of strings. Rows are
+sorted in natural order of scaffolds, then by position.
+
+The matrix can also be written as a binary store with --mmap (see
+meth_matrix.py), skipping the conversion of the text table.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import meth_matrix
+import natural_order
+
+def read_cov(cov_filename):
+    """
+    Reads scaffolds, positions and methylation %s (as text, so that they are
+    written out unchanged) of a cov file.
+    """
+    cov = pd.read_table(cov_filename, header=None, usecols=[0, 1, 3],
+                        dtype={0: str, 1: np.int64, 3: str},
+                        keep_default_na=False)
+    return cov[0].values, cov[1].values, cov[3].values
+
+def sample_name(cov_filename):
+    """
+    'path/to/A1-F.cov' (or 'path/to/A1-F.cov.gz') --> 'A1-F'
+    """
+    cov_filename = os.path.basename(cov_filename)
+    if cov_filename.endswith('.gz'):
+        cov_filename = cov_filename[:-3]
+    
+    return cov_filename.replace('.cov', '')
+
+parser = argparse.ArgumentParser(description="""
+Tabulates methylation %s of bismark cov files into a positions x samples
+matrix.""")
+
+parser.add_argument('cov_files', metavar='cov_filenames', type=str, nargs='+',
+                    help='bismark cov files (can be gzip-compressed).')
+parser.add_argument('--tsv', metavar='tsv_file', type=str,
+                    help='write matrix as a text table (e.g. all.filt.pct.tsv).')
+parser.add_argument('--mmap', metavar='store_dir', type=str,
+                    help="""write matrix as a binary store (e.g.
+                    all.filt.pct.mmap).""")
+parser.add_argument('-v', action='store_true',
+                    help="verbose mode, prints extra details to stderr.")
+args = parser.parse_args()
+
+if not args.tsv and not args.mmap:
+    parser.error('at least one of --tsv and --mmap is required')
+
+# read data
+covs = []
+for n, cov_filename in enumerate(args.cov_files):
+    if args.v:
+        print ('\rReading file #{}'.format(n + 1), end='', file=sys.stderr)
+    
+    covs.append(read_cov(cov_filename))
+
+# give every position an int64 key (natural order of scaffold << 32 | pos),
+# so that sorting keys sorts positions in the same order as natural_sort
+# sorts 'scaffold\tpos' strings
+scaffolds = natural_order.sort_scaffolds(
+    set().union(*[pd.unique(scafs) for scafs, _, _ in covs]))
+scaffold_index = pd.Index(scaffolds)
+cov_keys = [scaffold_index.get_indexer(scafs).astype(np.int64) << 32 | pos
+            for scafs, pos, _ in covs]
+
+all_keys = np.unique(np.concatenate(cov_keys))
+if args.v:
+    print ('\nUnion of all files produces {} rows.'.format(len(all_keys)),
+           file=sys.stderr)
+
+samples = [sample_name(x) for x in args.cov_files]
+scaffold_codes = (all_keys >> 32).astype(np.int32)
+positions = all_keys & 0xffffffff
+
+# write data
+if args.tsv:
+    table = pd.DataFrame({'scaffold': np.array(scaffolds)[scaffold_codes],
+                          'pos': positions})
+    for sample, (_, _, pcts), keys in zip(samples, covs, cov_keys):
+        column = np.full(len(all_keys), '', dtype=object)
+        column[np.searchsorted(all_keys, keys)] = pcts
+        table[sample] = column
+    
+    table.to_csv(args.tsv, sep='\t', index=False)
+
+if args.mmap:
+    values = np.full((len(all_keys), len(samples)), np.nan, dtype=np.float32,
+                     order='F')
+    for n, ((_, _, pcts), keys) in enumerate(zip(covs, cov_keys)):
+        values[np.searchsorted(all_keys, keys), n] = pcts.astype(np.float32)
+    
+    meth_matrix.save(args.mmap, scaffolds, scaffold_codes, positions, samples,
+                     values)